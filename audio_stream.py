@@ -0,0 +1,157 @@
+"""
+Streaming narration audio.
+
+tortoise_gen.py appends each synthesized chunk to final_output.wav as soon as it
+is ready instead of holding the whole narration in memory. The WAV header is
+rewritten after every chunk, so the file on disk is always a valid (shorter)
+WAV, and a small JSON file next to it publishes progress:
+
+    voice/final_output.wav
+    voice/final_output.progress.json   {"chunks_done", "total_chunks", "seconds", "done", "failed"}
+
+Downstream stages call wait_for_audio() before they need the complete file.
+Standard library only, so every env (and pipe.py) can import it.
+"""
+
+import json
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Optional
+
+SAMPLE_RATE = 24000
+
+
+def progress_path(wav_path) -> Path:
+    wav_path = Path(wav_path)
+    return wav_path.with_name(wav_path.stem + ".progress.json")
+
+
+def read_progress(wav_path) -> Optional[dict]:
+    """Latest published progress for `wav_path`, or None when it isn't being streamed."""
+    try:
+        return json.loads(progress_path(wav_path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def wait_for_audio(wav_path, timeout: Optional[float] = None, poll: float = 1.0) -> Optional[dict]:
+    """Block until a streamed WAV is complete. Returns immediately for non-streamed files."""
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        progress = read_progress(wav_path)
+        if progress is None or progress.get("done"):
+            return progress
+        if progress.get("failed"):
+            raise RuntimeError(f"TTS failed while writing {wav_path}")
+        if deadline is not None and time.time() > deadline:
+            raise TimeoutError(f"Timed out waiting for {wav_path}")
+        time.sleep(poll)
+
+
+def wav_duration(wav_path) -> float:
+    """Duration in seconds from the WAV header (any PCM or float WAV), without decoding."""
+    with open(wav_path, "rb") as f:
+        if f.read(12)[8:] != b"WAVE":
+            raise ValueError(f"Not a WAV file: {wav_path}")
+        byte_rate = None
+        while True:
+            head = f.read(8)
+            if len(head) < 8:
+                raise ValueError(f"No data chunk in {wav_path}")
+            cid, size = head[:4], struct.unpack("<I", head[4:])[0]
+            if cid == b"fmt ":
+                byte_rate = struct.unpack("<HHIIHH", f.read(16))[3]
+                f.seek(size - 16 + (size & 1), os.SEEK_CUR)
+            elif cid == b"data":
+                return size / byte_rate
+            else:
+                f.seek(size + (size & 1), os.SEEK_CUR)
+
+
+def mark_failed(wav_path) -> None:
+    """Flag an unfinished stream as failed (e.g. the TTS process died mid-write)."""
+    progress = read_progress(wav_path)
+    if progress is None or progress.get("done"):
+        return
+    progress["failed"] = True
+    path = progress_path(wav_path)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(progress), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def clear_stream(wav_path) -> None:
+    """Remove a previous attempt's WAV and progress file before synthesizing it again.
+
+    Otherwise a stale progress file ("failed", or "done" for a WAV about to be
+    truncated) would be read as this attempt's progress.
+    """
+    for path in (progress_path(wav_path), Path(wav_path)):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class StreamingWavWriter:
+    """Append mono float32 chunks to a WAV file, keeping the header valid after each one."""
+
+    def __init__(self, path, sample_rate: int = SAMPLE_RATE, total_chunks: Optional[int] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.sample_rate = sample_rate
+        self.total_chunks = total_chunks
+        self.chunks_done = 0
+        self.frames = 0
+        self._f = open(self.path, "wb")
+        self._f.write(self._header())
+        self._f.flush()
+        self._publish()
+
+    def _header(self) -> bytes:
+        data_bytes = self.frames * 4
+        # RIFF header with an IEEE-float (format 3) mono fmt chunk
+        return (b"RIFF" + struct.pack("<I", 36 + data_bytes) + b"WAVE"
+                + b"fmt " + struct.pack("<IHHIIHH", 16, 3, 1, self.sample_rate,
+                                        self.sample_rate * 4, 4, 32)
+                + b"data" + struct.pack("<I", data_bytes))
+
+    def _publish(self, done: bool = False, failed: bool = False):
+        progress = {
+            "chunks_done": self.chunks_done,
+            "total_chunks": self.total_chunks,
+            "seconds": self.frames / self.sample_rate,
+            "done": done,
+            "failed": failed,
+        }
+        path = progress_path(self.path)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(progress), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def write(self, samples) -> None:
+        """Append one chunk (a 1-D float32 numpy array; may be empty)."""
+        data = samples.astype("<f4").tobytes()
+        self._f.seek(0, os.SEEK_END)
+        self._f.write(data)
+        self.frames += len(data) // 4
+        self.chunks_done += 1
+        self._f.seek(0)
+        self._f.write(self._header())
+        self._f.flush()
+        self._publish()
+
+    def close(self, failed: bool = False) -> None:
+        if self._f.closed:
+            return
+        self._f.close()
+        self._publish(done=not failed, failed=failed)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(failed=exc_type is not None)
+        return False
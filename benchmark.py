@@ -0,0 +1,493 @@
+"""
+Offline benchmarks with stand-in models.
+
+Nothing here needs the Llama, Tortoise or SD weights or a GPU. The model
+classes are replaced by deterministic stand-ins before the stage modules are
+imported:
+- StubChatModel: a LocalChatModel whose generate step writes canned,
+  seed-stable text
+- StubTextToSpeech: a sine tone per chunk
+- StubSDPipeline: flat-colour images
+- StubSentenceTransformer: hash-seeded unit vectors
+
+Everything else is the repo's own code: the scheduler, job store, similarity
+guard, sanitizers, chunk cache, image library and renderers. The background
+videos, narration and images are synthetic too (ffmpeg testsrc, a sine WAV,
+test-pattern PNGs). Everything runs in a throwaway directory.
+
+Groups (--only a,b):
+  scheduler   pipe.py orchestration overhead over ideal pipelined time
+  similarity  SimilarityGuard check at growing history sizes
+  text        sanitizer / numbered-list / split_into_chunks throughput,
+              generate_stories with the stub LLM
+  tts         tortoise_gen.synthesize with the stub TTS (cold and cached)
+  images      imager.generate_images with the stub SD pipeline
+  render      render fps per backend and story length (needs ffmpeg + moviepy)
+
+A group whose real dependencies (torch, PIL, moviepy, ffmpeg) are missing
+is reported as skipped.
+
+    python benchmark.py                   # run and print
+    python benchmark.py --save-baseline   # ... and store benchmarks/baseline.json
+    python benchmark.py --compare         # ... and compare with it (exit 1 on a regression,
+                                          #     2 when there is no baseline of the same mode)
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+
+REPO = Path(__file__).resolve().parent
+BASELINE = REPO / "benchmarks" / "baseline.json"
+REGRESSION_TOLERANCE = 0.20  # a metric this much worse than the baseline is a regression
+MIN_DELTA = {"s": 0.05, "ms": 0.5}  # ... and worse by at least this much (timer noise on tiny values)
+EMB_DIM = 384
+WORDS = ("the ancient city rose above a quiet river where traders met at dawn and scholars "
+         "argued about stars tides metals maps and the slow patient work of empires").split()
+
+results: Dict[str, dict] = {}
+
+
+def record(name: str, value: float, unit: str, better: str = "lower") -> None:
+    results[name] = {"value": round(value, 6), "unit": unit, "better": better}
+    print(f"  {name:<44} {value:>12.4f} {unit}", file=sys.__stdout__)
+
+
+def timed(fn: Callable, repeat: int = 1) -> float:
+    """Best wall time of `repeat` runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def words(rng: random.Random, n: int) -> str:
+    out = []
+    for i in range(n):
+        w = rng.choice(WORDS)
+        out.append(w + ("." if i % 12 == 11 else ""))
+    return " ".join(out).capitalize()
+
+
+# =========================
+# Stand-in backends
+# =========================
+class StubSentenceTransformer:
+    def __init__(self, model_name: str = "", *args, **kwargs):
+        self.model_name = model_name
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return EMB_DIM
+
+    def encode(self, texts, normalize_embeddings=True, convert_to_numpy=True, **kwargs):
+        vecs = []
+        for t in texts:
+            seed = int(hashlib.sha256(t.encode("utf-8")).hexdigest()[:8], 16)
+            v = np.random.default_rng(seed).standard_normal(EMB_DIM).astype(np.float32)
+            vecs.append(v / np.linalg.norm(v))
+        return np.stack(vecs) if vecs else np.zeros((0, EMB_DIM), dtype=np.float32)
+
+
+class _StubTensor:
+    """Just enough of a torch tensor for tortoise_gen (squeeze/detach/cpu/numpy)."""
+
+    def __init__(self, array):
+        self.array = array
+
+    def squeeze(self):
+        return self
+
+    def detach(self):
+        return self
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+
+class StubTextToSpeech:
+    """Tortoise stand-in: a short sine tone per chunk, length proportional to the text."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_conditioning_latents(self, voice_samples):
+        import torch
+        return torch.zeros(1, 1024), torch.zeros(1, 1024)
+
+    def tts_with_preset(self, text, preset="fast", num_autoregressive_samples=4, **kwargs):
+        n = int(24000 * len(text) / 15)
+        t = np.arange(n, dtype=np.float32) / 24000
+        return _StubTensor((0.1 * np.sin(2 * np.pi * 220 * t)).astype(np.float32))
+
+
+class _StubImages:
+    def __init__(self, images):
+        self.images = images
+
+
+class StubSDPipeline:
+    """StableDiffusionPipeline stand-in: one flat colour per prompt."""
+    device = "cpu"
+
+    def __init__(self, **components):
+        self.components = components
+
+    @classmethod
+    def from_pretrained(cls, *args, **kwargs):
+        return cls()
+
+    def to(self, device):
+        return self
+
+    def __call__(self, prompt, height=768, width=768, image=None, generator=None, **kwargs):
+        from PIL import Image
+        prompts = [prompt] if isinstance(prompt, str) else prompt
+        out = []
+        for p in prompts:
+            h = hashlib.sha256(p.encode("utf-8")).digest()
+            size = image[0].size if image else (width, height)
+            out.append(Image.new("RGB", size, (h[0], h[1], h[2])))
+        return _StubImages(out)
+
+
+def install_stubs(workdir: Path) -> None:
+    """Put stand-in model libraries in sys.modules so no weights are ever loaded."""
+    st = types.ModuleType("sentence_transformers")
+    st.SentenceTransformer = StubSentenceTransformer
+    sys.modules["sentence_transformers"] = st
+
+    tf = types.ModuleType("transformers")
+
+    class _NoModel:
+        @classmethod
+        def from_pretrained(cls, *args, **kwargs):
+            raise RuntimeError("benchmark uses StubChatModel, not a real model")
+
+    tf.AutoTokenizer = tf.AutoModelForCausalLM = _NoModel
+    tf.StoppingCriteria = object
+    tf.StoppingCriteriaList = list
+    sys.modules["transformers"] = tf
+
+    df = types.ModuleType("diffusers")
+    df.StableDiffusionPipeline = StubSDPipeline
+    df.StableDiffusionImg2ImgPipeline = StubSDPipeline
+    sys.modules["diffusers"] = df
+
+    voice_dir = workdir / "voices" / "daniel"
+    voice_dir.mkdir(parents=True, exist_ok=True)
+    (voice_dir / "1.wav").write_bytes(b"stub voice sample")
+    tortoise = types.ModuleType("tortoise")
+    api = types.ModuleType("tortoise.api")
+    api.TextToSpeech = StubTextToSpeech
+    utils = types.ModuleType("tortoise.utils")
+    audio = types.ModuleType("tortoise.utils.audio")
+    audio.get_voices = lambda: {"daniel": [str(voice_dir / "1.wav")]}
+    audio.load_voice = lambda voice: ([], None)
+    sys.modules.update({"tortoise": tortoise, "tortoise.api": api,
+                        "tortoise.utils": utils, "tortoise.utils.audio": audio})
+
+
+def load_module(name: str, filename: str):
+    spec = importlib.util.spec_from_file_location(name, REPO / filename)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_stub_chat_model(textgen):
+    class StubChatModel(textgen.LocalChatModel):
+        """LocalChatModel with its generate step replaced by seed-stable canned text."""
+
+        def __init__(self):
+            self._prefix_cache = {}
+            self.calls = 0
+
+        def _generate(self, pairs, temperature, top_p, max_new_tokens, stop_when=None):
+            replies = []
+            for system_prompt, user_prompt in pairs:
+                self.calls += 1
+                rng = random.Random(f"{user_prompt}:{self.calls}")
+                if system_prompt == textgen.IMAGE_PROMPT_SYSTEM:
+                    replies.append("\n".join(f"{i}. {words(rng, 14)}" for i in range(1, 11)) + "\n")
+                else:
+                    replies.append(words(rng, rng.randint(330, 480)))
+            return replies
+
+    return StubChatModel()
+
+
+# =========================
+# Groups
+# =========================
+def bench_scheduler(work: Path, quick: bool) -> None:
+    pipe = load_module("pipe", "pipe.py")
+    narr = work / "outputs" / "bench_narration.txt"
+    imgs = work / "outputs" / "bench_images.txt"
+    narr.parent.mkdir(exist_ok=True)
+    narr.write_text(words(random.Random(0), 400), encoding="utf-8")
+    imgs.write_text("img_prompts_1 = ['a', 'b']", encoding="utf-8")
+    pipe.generate_one_story = lambda remaining=1: (narr, imgs)
+
+    def stub_stage(name: str, seconds: float, outputs: Callable[[Path], List[Path]]):
+        def stage(story, emit=None):
+            time.sleep(seconds)
+            for p in outputs(story["dir"]):
+                p.parent.mkdir(parents=True, exist_ok=True)
+                p.write_bytes(name.encode())
+            return story
+        return stage
+
+    def run(n: int, scale: float) -> float:
+        pipe.STAGES[:] = [
+            ("generate", pipe.stage_generate),
+            ("tts", stub_stage("tts", 0.20 * scale, lambda d: [d / "voice" / "final_output.wav"])),
+            ("images", stub_stage("images", 0.10 * scale, lambda d: [d / "images" / "generated_1.png"])),
+            ("render", stub_stage("render", 0.10 * scale, lambda d: [d / "Final.mp4"])),
+        ]
+        t0 = time.perf_counter()
+        done = pipe.run_pipelined([{"index": i + 1, "total": n} for i in range(n)])
+        assert len(done) == n
+        return time.perf_counter() - t0
+
+    n = 4 if quick else 8
+    wall = run(n, 1.0)
+    # Bottleneck stage (tts, concurrency 1) sets the pace once the pipeline is full
+    ideal = 0.20 + 0.10 + 0.10 + (n - 1) * 0.20
+    record("scheduler.overhead_s", wall - ideal, "s")
+    n_fast = 20 if quick else 100
+    record("scheduler.per_story_stage_ms", run(n_fast, 0.0) / (n_fast * 4) * 1000, "ms")
+
+
+def bench_similarity(work: Path, quick: bool) -> None:
+    textgen = load_module("textgen", "text-gen-v13.py")
+    guard = textgen.SimilarityGuard(textgen.EMB_MODEL)
+    texts = [words(random.Random(i), 400) for i in range(textgen.NUM_CANDIDATES)]
+    rng = np.random.default_rng(0)
+    for n in ((1_000, 10_000) if quick else (1_000, 10_000, 100_000)):
+        m = rng.standard_normal((n, EMB_DIM)).astype(np.float32)
+        guard.matrix = m / np.linalg.norm(m, axis=1, keepdims=True)
+        record(f"similarity.check_ms@{n}", timed(lambda: guard.max_similarities(texts), 10) * 1000, "ms")
+
+
+def bench_text(work: Path, quick: bool) -> None:
+    textgen = load_module("textgen", "text-gen-v13.py")
+    rng = random.Random(1)
+    scripts = [f"Narration:\n{words(rng, 450)}\nassistant\nTopic: x" for _ in range(50 if quick else 200)]
+    chars = sum(len(s) for s in scripts)
+    record("text.sanitize_chars_per_s", chars / timed(lambda: [textgen.sanitize_narration(s) for s in scripts], 3),
+           "chars/s", "higher")
+    lists = ["\n".join(f"{i}. {words(rng, 14)}" for i in range(1, 11)) for _ in range(200)]
+    chars = sum(len(s) for s in lists)
+    record("text.parse_list_chars_per_s", chars / timed(lambda: [textgen.parse_numbered_list(s) for s in lists], 3),
+           "chars/s", "higher")
+
+    try:
+        tortoise_gen = load_module("tortoise_gen", "tortoise_gen.py")
+    except ImportError as e:
+        print(f"  text.split_into_chunks skipped: {e}", file=sys.__stdout__)
+    else:
+        chars = sum(len(s) for s in scripts)
+        record("text.split_chars_per_s",
+               chars / timed(lambda: [tortoise_gen.split_into_chunks(s) for s in scripts], 3), "chars/s", "higher")
+
+    # Whole text stage with the stub LLM: topic picking, candidates, similarity, sqlite, files
+    snapshot = work / "wiki_snapshot.jsonl"
+    with open(snapshot, "w", encoding="utf-8") as f:
+        for i, topic in enumerate(textgen.SEED_TOPICS):
+            r = random.Random(i)
+            f.write(json.dumps({"title": topic, "summary": words(r, 120),
+                                "sections": [words(r, 120) for _ in range(4)]}) + "\n")
+    textgen.ensure_dirs()
+    con = textgen.connect_db()
+    wiki = textgen.make_wiki(str(snapshot))
+    guard = textgen.SimilarityGuard(textgen.EMB_MODEL, con)
+    llm = make_stub_chat_model(textgen)
+    count = 4 if quick else 16
+    t = timed(lambda: textgen.generate_stories(con, wiki, guard, llm, count=count))
+    record("text.generate_stories_per_s", count / t, "stories/s", "higher")
+
+
+def bench_tts(work: Path, quick: bool) -> None:
+    tortoise_gen = load_module("tortoise_gen", "tortoise_gen.py")
+    tts, voices = tortoise_gen.load_tts()
+    latents = voices.latents(tortoise_gen.VOICE)
+    voice_id = voices.voice_id(tortoise_gen.VOICE)
+    text = words(random.Random(2), 200 if quick else 450)
+    out = work / "tts_story" / "voice"
+    cold = timed(lambda: tortoise_gen.synthesize(tts, latents, text, voice_id, out, budget=None, workers=0))
+    warm = timed(lambda: tortoise_gen.synthesize(tts, latents, text, voice_id, out, budget=None, workers=0), 3)
+    record("tts.story_s_uncached", cold, "s")
+    record("tts.story_s_cached", warm, "s")
+
+
+def bench_images(work: Path, quick: bool) -> None:
+    imager = load_module("imager", "imager.py")
+    rng = random.Random(3)
+    prompts = [words(rng, 14) for _ in range(10)]
+    out = work / "img_story" / "images"
+    cold = timed(lambda: imager.generate_images(prompts, output_folder=str(out), tier="full", video_height=1080))
+    warm = timed(lambda: imager.generate_images(prompts, output_folder=str(out), tier="full", video_height=1080))
+    record("images.story_s_uncached", cold, "s")
+    record("images.story_s_library", warm, "s")
+
+
+def _ffmpeg(*args: str) -> None:
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error", *args], check=True)
+
+
+def bench_render(work: Path, quick: bool) -> None:
+    if not shutil.which("ffmpeg") or not shutil.which("ffprobe"):
+        raise ImportError("ffmpeg/ffprobe not on PATH")
+    render = load_module("render", "render.py")
+    shorter = sys.modules["shorter"]
+    imagestack = sys.modules["imagestack"]
+    from audio_stream import StreamingWavWriter
+
+    lengths = (15,) if quick else (15, 30, 60)
+    vids = work / "vids"
+    vids.mkdir(exist_ok=True)
+    _ffmpeg("-f", "lavfi", "-i", "testsrc2=size=1920x1080:rate=30", "-t", str(max(lengths) + 15),
+            "-c:v", "libx264", "-preset", "ultrafast", "-g", "60", "-pix_fmt", "yuv420p", str(vids / "testsrc.mp4"))
+
+    backends = ["ffmpeg", "segments", "moviepy", "two-pass"]
+    for seconds in lengths:
+        story = work / f"render_{seconds}s"
+        (story / "images").mkdir(parents=True, exist_ok=True)
+        for i in range(10):
+            _ffmpeg("-f", "lavfi", "-i", "testsrc=size=448x448:rate=1", "-vf", f"hue=h={i * 36}",
+                    "-frames:v", "1", str(story / "images" / f"generated_{i + 1}.png"))
+        t = np.arange(int(24000 * (seconds - shorter.TAIL_S)), dtype=np.float32) / 24000
+        with StreamingWavWriter(story / "voice" / "final_output.wav") as w:
+            w.write((0.1 * np.sin(2 * np.pi * 220 * t)).astype(np.float32))
+        tl = render.plan(story)
+        frames = round(tl.duration * render.FPS)
+        for backend in backends:
+            shutil.rmtree(story / render.SEGMENT_DIRNAME, ignore_errors=True)
+            if backend == "two-pass":
+                wall = timed(lambda: (shorter.create_short(story), imagestack.stack_images(story)))
+            else:
+                wall = timed(lambda: render.BACKENDS[backend](tl))
+            record(f"render.fps.{backend}@{seconds}s", frames / wall, "fps", "higher")
+
+
+GROUPS = {
+    "scheduler": bench_scheduler,
+    "similarity": bench_similarity,
+    "text": bench_text,
+    "tts": bench_tts,
+    "images": bench_images,
+    "render": bench_render,
+}
+
+
+# =========================
+# Baseline
+# =========================
+def compare(baseline: dict, current: dict) -> List[str]:
+    """Print current vs baseline; returns the names of regressed metrics."""
+    regressions = []
+    print(f"\n{'metric':<46}{'baseline':>12}{'now':>12}{'change':>9}")
+    for name, now in sorted(current.items()):
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<46}{'-':>12}{now['value']:>12.4f}{'new':>9}")
+            continue
+        b, v = base["value"], now["value"]
+        change = (v - b) / abs(b) if b else 0.0
+        worse = change if now["better"] == "lower" else -change
+        noisy = abs(v - b) < MIN_DELTA.get(now["unit"], 0.0)
+        flag = " ⚠️" if worse > REGRESSION_TOLERANCE and not noisy else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<46}{b:>12.4f}{v:>12.4f}{change:>+8.0%}{flag}")
+    return regressions
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Offline benchmarks with stub models.")
+    ap.add_argument("--only", help="comma-separated groups: " + ",".join(GROUPS))
+    ap.add_argument("--quick", action="store_true", help="smaller sizes, for a fast smoke run")
+    ap.add_argument("--save-baseline", action="store_true", help=f"write results to {BASELINE}")
+    ap.add_argument("--compare", action="store_true", help=f"compare with {BASELINE}")
+    ap.add_argument("--baseline", type=Path, default=BASELINE)
+    ap.add_argument("--verbose", action="store_true", help="show the stages' own output")
+    args = ap.parse_args()
+
+    groups = args.only.split(",") if args.only else list(GROUPS)
+    work = Path(tempfile.mkdtemp(prefix="ytshort-bench-"))
+    cwd = os.getcwd()
+    sys.path.insert(0, str(REPO))
+    os.environ.pop("TRACE_FILE", None)
+    skipped = {}
+    try:
+        os.chdir(work)  # every relative cache / db path of the stage modules lands here
+        install_stubs(work)
+        for name in groups:
+            print(f"▶ {name}")
+            quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            try:
+                with quiet:
+                    GROUPS[name](work, args.quick)
+            except ImportError as e:
+                skipped[name] = str(e)
+                print(f"  skipped: {e}")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work, ignore_errors=True)
+
+    run = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "quick": args.quick,
+        "skipped": skipped,
+        "results": results,
+    }
+    code = 0
+    if args.compare:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline.exists() else None
+        if baseline is None:
+            print(f"❌ No baseline at {args.baseline}; run with --save-baseline first")
+            code = 2
+        elif baseline.get("quick", False) != args.quick:
+            mode = lambda quick: "--quick" if quick else "full"
+            print(f"❌ Baseline {args.baseline} is a {mode(baseline.get('quick', False))} run, this is a "
+                  f"{mode(args.quick)} run; their sizes differ, so they can't be compared")
+            code = 2
+        else:
+            regressions = compare(baseline["results"], results)
+            if regressions:
+                print(f"\n❌ {len(regressions)} regression(s) over {REGRESSION_TOLERANCE:.0%}: {', '.join(regressions)}")
+                code = 1
+            else:
+                print("\n✅ No regressions")
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(run, indent=2), encoding="utf-8")
+        print(f"Saved baseline to {args.baseline}")
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
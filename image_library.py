@@ -0,0 +1,138 @@
+"""
+Persistent image library shared across stories.
+
+The seed topic pool is small, so the same topics (and near-identical image
+prompts) come back after the cooldown. Every rendered image is stored here,
+indexed by an exact prompt hash and by a prompt embedding. imager.py asks the
+library first:
+
+- exact:  same prompt and size      -> copy the stored image
+- reuse:  similarity >= REUSE_THRESHOLD -> copy the closest stored image
+- vary:   similarity >= VARY_THRESHOLD  -> light img2img pass over the closest image
+- miss:   full diffusion render, then added to the library
+
+Embeddings need sentence-transformers; without it only exact hits are used.
+"""
+
+import hashlib
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Set, Tuple
+
+import numpy as np
+
+LIBRARY_DIR = Path("image_library")
+EMB_MODEL = "all-MiniLM-L6-v2"
+REUSE_THRESHOLD = 0.95
+VARY_THRESHOLD = 0.88  # set equal to REUSE_THRESHOLD to never vary
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(" ".join(prompt.lower().split()).encode("utf-8")).hexdigest()
+
+
+class ImageLibrary:
+    def __init__(self, root=LIBRARY_DIR, emb_model: str = EMB_MODEL):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(str(self.root / "index.sqlite"))
+        self.con.execute("""
+        CREATE TABLE IF NOT EXISTS images(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT,
+            prompt TEXT,
+            prompt_hash TEXT,
+            width INTEGER,
+            height INTEGER,
+            path TEXT,
+            embedding BLOB
+        )""")
+        self.con.execute("CREATE INDEX IF NOT EXISTS images_hash ON images(prompt_hash, width, height)")
+        self.con.commit()
+
+        try:
+            from sentence_transformers import SentenceTransformer
+            self.model = SentenceTransformer(emb_model)
+        except ImportError:
+            print("⚠️ sentence-transformers not installed: image library uses exact prompt matches only")
+            self.model = None
+
+        # (width, height) -> (row paths, (N, dim) matrix), loaded on first lookup
+        self._index = {}
+        self.stats = {"exact": 0, "reuse": 0, "vary": 0, "miss": 0}
+
+    def encode(self, prompt: str) -> Optional[np.ndarray]:
+        if self.model is None:
+            return None
+        vec = self.model.encode([prompt], normalize_embeddings=True, convert_to_numpy=True)[0]
+        return np.asarray(vec, dtype=np.float32)
+
+    def _size_index(self, width: int, height: int):
+        if (width, height) not in self._index:
+            rows = self.con.execute(
+                "SELECT path, embedding FROM images WHERE width = ? AND height = ? AND embedding IS NOT NULL",
+                (width, height),
+            ).fetchall()
+            paths = [r[0] for r in rows]
+            matrix = np.stack([np.frombuffer(r[1], dtype=np.float32) for r in rows]) if rows else None
+            self._index[(width, height)] = (paths, matrix)
+        return self._index[(width, height)]
+
+    def lookup(self, prompt: str, width: int, height: int,
+               exclude: Set[str] = frozenset()) -> Tuple[str, Optional[str], float]:
+        """(kind, stored path, similarity) with kind in exact/reuse/vary/miss.
+
+        Paths in `exclude` (already used in this story) are skipped, so one
+        story never shows the same picture twice.
+        """
+        for (path,) in self.con.execute(
+            "SELECT path FROM images WHERE prompt_hash = ? AND width = ? AND height = ? ORDER BY id DESC",
+            (prompt_hash(prompt), width, height),
+        ):
+            if path not in exclude and Path(path).exists():
+                return "exact", path, 1.0
+
+        vec = self.encode(prompt)
+        paths, matrix = self._size_index(width, height)
+        if vec is not None and matrix is not None:
+            sims = matrix @ vec
+            for i in np.argsort(-sims):
+                sim = float(sims[i])
+                if sim < VARY_THRESHOLD:
+                    break
+                if paths[i] in exclude or not Path(paths[i]).exists():
+                    continue
+                return ("reuse" if sim >= REUSE_THRESHOLD else "vary"), paths[i], sim
+        return "miss", None, 0.0
+
+    def add(self, prompt: str, image, width: int, height: int) -> str:
+        """Store a rendered PIL image and index it; returns its library path."""
+        h = prompt_hash(prompt)
+        path = self.root / h[:2] / f"{h}_{width}x{height}_{datetime.now().strftime('%Y%m%d%H%M%S%f')}.png"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        image.save(path)
+        vec = self.encode(prompt)
+        self.con.execute(
+            "INSERT INTO images(created_at, prompt, prompt_hash, width, height, path, embedding) VALUES(?,?,?,?,?,?,?)",
+            (datetime.utcnow().isoformat(), prompt, h, width, height, str(path),
+             None if vec is None else vec.tobytes()),
+        )
+        self.con.commit()
+        if vec is not None and (width, height) in self._index:
+            paths, matrix = self._index[(width, height)]
+            matrix = vec[None, :] if matrix is None else np.vstack([matrix, vec])
+            self._index[(width, height)] = (paths + [str(path)], matrix)
+        return str(path)
+
+    def record(self, kind: str) -> None:
+        """Count a lookup outcome in the cumulative (per-process) stats."""
+        self.stats[kind] += 1
+
+    @staticmethod
+    def report(run_stats: dict) -> str:
+        total = sum(run_stats.values()) or 1
+        hits = total - run_stats.get("miss", 0)
+        return (f"📚 Image library: {run_stats['exact']} exact, {run_stats['reuse']} reused, "
+                f"{run_stats['vary']} varied, {run_stats['miss']} rendered "
+                f"({hits / total:.0%} hit rate)")
@@ -1,46 +1,185 @@
-from diffusers import StableDiffusionPipeline
+from diffusers import StableDiffusionPipeline, StableDiffusionImg2ImgPipeline
+from PIL import Image
 import torch
 import os
-from pathlib import Path
+import shutil
+import hashlib
+from typing import NamedTuple
 
-def get_latest_timestamped_dir(base_path='.'):
-    base = Path(base_path)
-    # Only select directories with purely numeric names of the correct length (e.g., 12 for 'YYYYMMDDHHMM')
-    timestamped_dirs = [d for d in base.iterdir() if d.is_dir() and d.name.isdigit() and len(d.name) == 12]
-    if not timestamped_dirs:
-        return None  # or raise an error if you want
+from jobstore import get_latest_timestamped_dir
+from tracing import span
 
-    # Sort them by name (chronological order because of format)
-    latest_dir = max(timestamped_dirs, key=lambda d: d.name)
-    return latest_dir
+BATCH_SIZE = int(os.environ.get("IMAGER_BATCH", "0"))  # prompts per diffusion run; 0 = from free GPU memory
+MAX_BATCH_SIZE = 8
+IMAGE_MEM_MB = 2500  # rough peak per 768x768 fp16 image, used to size batches (scaled by area)
+BASE_SEED = 0  # with the prompt, fixes each image's seed so renders are reproducible
+USE_LIBRARY = os.environ.get("IMAGE_LIBRARY", "1") != "0"  # reuse images across stories (image_library.py)
+VARY_STRENGTH = 0.35  # img2img strength when lightly varying a close library image
 
-# Usage
-latest = get_latest_timestamped_dir()
+# Render-size planning: imagestack.py scales every image to video height / 2.5,
+# so there is no point diffusing at more pixels than that.
+OVERLAY_SCALE = 2.5
+RENDER_HEIGHT = int(os.environ.get("RENDER_HEIGHT", "1080"))  # background video height
 
+class Tier(NamedTuple):
+    scale: float     # generation side relative to the overlay side
+    min_side: int    # SD 2.1 (768-v) degrades badly far below its training size
+    max_side: int
+    steps: int
+    upscale: bool    # LANCZOS-upscale to the overlay size before saving
 
+TIERS = {
+    "full": Tier(1.0, 512, 768, 50, False),
+    "draft": Tier(0.5, 256, 512, 20, True),  # previews and CPU-only nodes
+}
 
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+IMAGE_TIER = os.environ.get("IMAGER_TIER", "full" if DEVICE == "cuda" else "draft")
 
 # Load pipeline once (globally)
 pipe = StableDiffusionPipeline.from_pretrained(
     "stabilityai/stable-diffusion-2-1",
-    torch_dtype=torch.float16
-).to("cuda")
+    torch_dtype=torch.float16 if DEVICE == "cuda" else torch.float32
+).to(DEVICE)
 
-def generate_images(prompts, prefix="generated"):
+_library = None
+_img2img = None
+
+def get_library():
+    global _library
+    if _library is None and USE_LIBRARY:
+        from image_library import ImageLibrary
+        _library = ImageLibrary()
+    return _library
+
+def get_img2img():
+    """Img2img pipeline sharing the already loaded SD weights (no extra GPU memory)."""
+    global _img2img
+    if _img2img is None:
+        _img2img = StableDiffusionImg2ImgPipeline(**pipe.components)
+    return _img2img
+
+def prompt_seed(prompt, base_seed=BASE_SEED):
+    """Deterministic per-prompt seed: the same prompt gives the same image in any batch."""
+    return int(hashlib.sha256(f"{base_seed}:{prompt}".encode("utf-8")).hexdigest()[:8], 16)
+
+def plan_size(video_height=RENDER_HEIGHT, tier=IMAGE_TIER):
+    """(generation side, overlay side) in pixels for the square images of `tier`.
+
+    The generation side is the overlay side times the tier scale, rounded up to
+    a multiple of 64 (the SD latent grid) and clamped to the tier's range.
+    """
+    t = TIERS[tier]
+    overlay = int(video_height // OVERLAY_SCALE)
+    side = -(-int(overlay * t.scale) // 64) * 64
+    return max(t.min_side, min(t.max_side, side)), overlay
+
+def auto_batch_size(side=768):
+    if not torch.cuda.is_available():
+        return 1
+    free, _ = torch.cuda.mem_get_info()
+    per_image = IMAGE_MEM_MB * (side / 768) ** 2 * 1024 * 1024
+    return max(1, min(MAX_BATCH_SIZE, int(free // per_image)))
+
+def _batched(run, n, batch_size):
+    """Call run(start, end) over [0, n) in batches; halve the batch size on CUDA OOM."""
+    results = []
+    i = 0
+    while i < n:
+        end = min(n, i + batch_size)
+        try:
+            results.extend(run(i, end))
+        except torch.cuda.OutOfMemoryError:
+            if batch_size == 1:
+                raise
+            batch_size //= 2
+            torch.cuda.empty_cache()
+            print(f"⚠️ Out of GPU memory, retrying with batch size {batch_size}")
+            continue
+        i = end
+    return results
+
+def generate_images(prompts, prefix="generated", output_folder=None, batch_size=None, seed=BASE_SEED,
+                    tier=None, video_height=None):
     """
     Generates images from a list of prompts using Stable Diffusion.
 
     Args:
         prompts (List[str]): List of prompt strings.
-        output_folder (str): Where to save generated images.
         prefix (str): Filename prefix for the images.
+        output_folder (str): Where to save generated images
+            (default: images/ in the latest timestamped dir).
+        batch_size (int): Prompts per pipeline call (default: BATCH_SIZE, or sized
+            from free GPU memory). Halved and retried when the GPU runs out of memory.
+        seed (int): Base seed; each prompt gets its own generator seeded from it.
+        tier (str): "full" or "draft" (default: IMAGE_TIER, from $IMAGER_TIER).
+        video_height (int): Height of the background video the images are overlaid
+            on (default: RENDER_HEIGHT); sets the generation size via plan_size().
+
+    With the image library enabled, prompts that match a stored image (exactly
+    or by embedding similarity) copy or lightly vary it instead of a full render.
     """
-    latest = get_latest_timestamped_dir()
-    output_folder = str(latest / 'images')
+    if output_folder is None:
+        latest = get_latest_timestamped_dir()
+        output_folder = str(latest / 'images')
     os.makedirs(output_folder, exist_ok=True)
+    tier = tier or IMAGE_TIER
+    steps, upscale = TIERS[tier].steps, TIERS[tier].upscale
+    side, overlay = plan_size(video_height or RENDER_HEIGHT, tier)
+    width = height = side
+    batch_size = batch_size or BATCH_SIZE or auto_batch_size(side)
+    print(f"🔹 {tier} tier: {side}x{side}, {steps} steps (overlay {overlay}px)")
+    out_path = lambda i: os.path.join(output_folder, f"{prefix}_{i+1}.png")
+
+    def save(image, i):
+        if upscale and side < overlay:
+            image = image.resize((overlay, overlay), Image.LANCZOS)
+        image.save(out_path(i))
 
+    library = get_library()
+    run_stats = {"exact": 0, "reuse": 0, "vary": 0, "miss": 0}
+    to_render, to_vary, used = [], [], set()
     for i, prompt in enumerate(prompts):
-        print(f"🔹 Generating image {i+1}/{len(prompts)}: {prompt}")
-        image = pipe(prompt, height=768, width=768).images[0]  # SD 2.1 supports 768x768
-        image.save(os.path.join(output_folder, f"{prefix}_{i+1}.png"))
+        kind, path, sim = library.lookup(prompt, width, height, exclude=used) if library else ("miss", None, 0.0)
+        run_stats[kind] += 1
+        if library:
+            library.record(kind)
+        if kind == "miss":
+            to_render.append(i)
+            continue
+        used.add(path)
+        if kind == "vary":
+            to_vary.append((i, path))
+        else:
+            print(f"🔹 Image {i+1}/{len(prompts)} from library ({kind}, sim {sim:.2f})")
+            if upscale and side < overlay:
+                save(Image.open(path), i)
+            else:
+                shutil.copyfile(path, out_path(i))
+
+    def render(start, end):
+        batch = [prompts[to_render[k]] for k in range(start, end)]
+        print(f"🔹 Generating images {start+1}-{end}/{len(to_render)} (batch of {len(batch)})")
+        generators = [torch.Generator(device=pipe.device).manual_seed(prompt_seed(p, seed)) for p in batch]
+        with span("image.render_batch", images=len(batch), side=side, steps=steps, tier=tier):
+            return pipe(batch, height=height, width=width, num_inference_steps=steps, generator=generators).images
+
+    def vary(start, end):
+        batch = [prompts[to_vary[k][0]] for k in range(start, end)]
+        init = [Image.open(to_vary[k][1]).convert("RGB") for k in range(start, end)]
+        print(f"🔹 Varying library images {start+1}-{end}/{len(to_vary)}")
+        generators = [torch.Generator(device=pipe.device).manual_seed(prompt_seed(p, seed)) for p in batch]
+        with span("image.vary_batch", images=len(batch), side=side, steps=steps, tier=tier):
+            return get_img2img()(batch, image=init, strength=VARY_STRENGTH, num_inference_steps=steps,
+                                 generator=generators).images
+
+    for i, image in zip(to_render, _batched(render, len(to_render), batch_size)):
+        save(image, i)
+        if library:
+            library.add(prompts[i], image, width, height)
+    for (i, _), image in zip(to_vary, _batched(vary, len(to_vary), batch_size)):
+        save(image, i)
 
+    if library:
+        print(library.report(run_stats))
+    return output_folder
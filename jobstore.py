@@ -0,0 +1,177 @@
+"""
+Crash-resumable job store for pipe.py.
+
+Each story is a job with its own ID and workspace directory, jobs/<job_id>/,
+which holds everything the stages read and write:
+
+    jobs/<job_id>/narration.txt, prompts.json   (generate)
+    jobs/<job_id>/voice/final_output.wav        (tts)
+    jobs/<job_id>/images/*.png                  (images)
+    jobs/<job_id>/Final.mp4                     (render)
+
+jobs/jobs.sqlite records every stage's status and the sha256 of its outputs.
+A stage counts as done only while its outputs are still on disk unchanged, so
+`pipe.py --resume` re-runs exactly the stages that did not finish. Job IDs are
+unique per host, so concurrent stories and concurrent runs never share files.
+Standard library only.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+JOBS_DIR = Path("jobs")
+
+
+def get_latest_timestamped_dir(base_path='.'):
+    """Newest story dir: a job workspace (jobs/<YYYYMMDDHHMMSS-xxxxxx>) or a
+    pre-job-store YYYYMMDDHHMM dir. None when there is neither.
+
+    Used by the standalone scripts when no story dir is given.
+    """
+    base = Path(base_path)
+    # Only select directories with purely numeric names of the correct length (e.g., 12 for 'YYYYMMDDHHMM')
+    timestamped_dirs = [(d.name + "00", d) for d in base.iterdir()
+                        if d.is_dir() and d.name.isdigit() and len(d.name) == 12]
+    jobs = base / JOBS_DIR
+    if jobs.is_dir():
+        timestamped_dirs += [(d.name[:14], d) for d in jobs.iterdir() if d.is_dir() and d.name[:14].isdigit()]
+    if not timestamped_dirs:
+        return None
+    # Sort them by name (chronological order because of format)
+    return max(timestamped_dirs)[1]
+
+
+def file_sha256(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class JobStore:
+    def __init__(self, root=JOBS_DIR):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.con = sqlite3.connect(str(self.root / "jobs.sqlite"), timeout=30, check_same_thread=False)
+        self.con.executescript("""
+        CREATE TABLE IF NOT EXISTS jobs(
+            id TEXT PRIMARY KEY,
+            created_at TEXT,
+            status TEXT,
+            narration TEXT,
+            images TEXT,
+            pid INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS stages(
+            job_id TEXT,
+            stage TEXT,
+            status TEXT,
+            started_at REAL,
+            finished_at REAL,
+            error TEXT,
+            outputs TEXT,
+            PRIMARY KEY (job_id, stage)
+        );
+        """)
+        self.con.commit()
+
+    def workspace(self, job_id: str) -> Path:
+        return self.root / job_id
+
+    def create_job(self, narration: Optional[Path] = None, images: Optional[Path] = None) -> str:
+        """New job with a fresh workspace; returns its ID (<timestamp>-<random>)."""
+        job_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.workspace(job_id).mkdir(parents=True)
+        with self._lock:
+            self.con.execute("INSERT INTO jobs VALUES(?,?,?,?,?,?)",
+                             (job_id, datetime.now().isoformat(), "running",
+                              str(narration) if narration else None, str(images) if images else None,
+                              os.getpid()))
+            self.con.commit()
+        return job_id
+
+    def start_stage(self, job_id: str, stage: str) -> None:
+        with self._lock:
+            self.con.execute("INSERT OR REPLACE INTO stages VALUES(?,?,?,?,?,?,?)",
+                             (job_id, stage, "running", time.time(), None, None, None))
+            self.con.commit()
+
+    def finish_stage(self, job_id: str, stage: str, outputs: Iterable[Path]) -> None:
+        """Mark `stage` done and record the hash of each output (paths relative to the workspace)."""
+        ws = self.workspace(job_id)
+        hashes = {str(Path(p).relative_to(ws)): file_sha256(p) for p in outputs}
+        with self._lock:
+            self.con.execute("UPDATE stages SET status = 'done', finished_at = ?, outputs = ? "
+                             "WHERE job_id = ? AND stage = ?",
+                             (time.time(), json.dumps(hashes), job_id, stage))
+            self.con.commit()
+
+    def fail_stage(self, job_id: str, stage: str, error: str) -> None:
+        with self._lock:
+            self.con.execute("UPDATE stages SET status = 'failed', finished_at = ?, error = ? "
+                             "WHERE job_id = ? AND stage = ?", (time.time(), error, job_id, stage))
+            self.con.execute("UPDATE jobs SET status = 'failed' WHERE id = ?", (job_id,))
+            self.con.commit()
+
+    def finish_job(self, job_id: str) -> None:
+        with self._lock:
+            self.con.execute("UPDATE jobs SET status = 'done' WHERE id = ?", (job_id,))
+            self.con.commit()
+
+    def stage_done(self, job_id: str, stage: str) -> bool:
+        """True when `stage` finished and all its recorded outputs are still on disk unchanged."""
+        with self._lock:
+            row = self.con.execute("SELECT status, outputs FROM stages WHERE job_id = ? AND stage = ?",
+                                   (job_id, stage)).fetchone()
+        if not row or row[0] != "done":
+            return False
+        ws = self.workspace(job_id)
+        for rel, digest in json.loads(row[1] or "{}").items():
+            path = ws / rel
+            if not path.exists() or file_sha256(path) != digest:
+                return False
+        return True
+
+    def stages(self, job_id: str) -> Dict[str, str]:
+        with self._lock:
+            rows = self.con.execute("SELECT stage, status FROM stages WHERE job_id = ?", (job_id,)).fetchall()
+        return dict(rows)
+
+    def unfinished_jobs(self) -> List[str]:
+        """IDs of jobs that did not finish (crashed or failed), oldest first.
+
+        Jobs still owned by a live pipe.py process (a concurrent run) are left alone.
+        """
+        with self._lock:
+            rows = self.con.execute(
+                "SELECT id, pid FROM jobs WHERE status != 'done' ORDER BY created_at").fetchall()
+        return [job_id for job_id, pid in rows
+                if os.path.isdir(self.workspace(job_id)) and not _pid_alive(pid)]
+
+    def claim(self, job_id: str) -> None:
+        """Take over an unfinished job for this process (see unfinished_jobs)."""
+        with self._lock:
+            self.con.execute("UPDATE jobs SET status = 'running', pid = ? WHERE id = ?", (os.getpid(), job_id))
+            self.con.commit()
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
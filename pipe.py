@@ -3,22 +3,40 @@
 Pipeline runner:
 1) Calls your local RAG story generator script (creates narration + image prompts in ./outputs)
 2) Picks up the newest generated pair
-3) Runs your TTS + image + stacking steps automatically
+3) Runs your TTS + image + render steps automatically
+
+With PIPELINED = True several stories are in flight at once: each stage has its
+own bounded queue and concurrency limit (STAGE_CONCURRENCY), so a batch runs at
+roughly the speed of the slowest stage instead of the sum of all stages.
+
+Every story is a job with its own workspace, jobs/<job_id>/ (see jobstore.py);
+finished stages are recorded there, so a crashed run can be picked up again.
 
 Edit the CONFIG paths below to match your environment.
 Run:
-    python generate_all.py                 # generate 1 story and make a video
-    python generate_all.py 3               # generate 3 stories in a row and make 3 videos
+    python pipe.py                 # generate 1 story and make a video
+    python pipe.py 3               # generate 3 stories in a row and make 3 videos
+    python pipe.py --resume        # finish the stories of crashed / failed runs
+    python pipe.py 2 --resume      # ... then generate 2 new ones
 """
 
+import os
 import sys
 import json
+import argparse
 import time
+import queue
+import threading
 from pathlib import Path
 import subprocess
-from typing import List, Tuple
+from typing import Callable, List, Optional, Tuple
 import ast  # <-- Add this import
 
+from audio_stream import clear_stream, mark_failed, read_progress
+from jobstore import JobStore
+from tracing import new_trace_file, span
+from workers import WorkerClient
+
 # =========================
 # CONFIG — change as needed
 # =========================
@@ -34,11 +52,30 @@ IMAGER_PY = "/home/mahdi/imager310/bin/python"
 
 # Your component scripts
 TORTOISE_GEN = "tortoise_gen.py"  # expects: python tortoise_gen.py "<story>"
-SHORTER = "shorter.py"            # trims/edits audio if needed
 IMAGER = "run_imager.py"          # expects: python run_imager.py tmp_prompts.json
-IMAGESTACK = "imagestack.py"      # stitches frames to video, uses tortoise env python
+RENDER = "render.py"              # background crop + overlays + audio in one encode, uses tortoise env python
+
+TTS_BUDGET_S = None  # per-story TTS deadline in seconds (adaptive presets, see tts_budget.py)
+GENERATE_BATCH = 4  # stories per generator call (batched LLM passes, see --count)
+IMAGE_TIER = None  # "full" or "draft" (fewer steps, lower resolution, upscaled); None = imager.py's default:
+                   # full with a GPU, draft on CPU-only nodes
+RENDER_HEIGHT = 1080  # background video height; images are generated for its overlay size
+RENDER_BACKEND = "ffmpeg"  # "ffmpeg" filter graph, "segments" (parallel per-image segments) or "moviepy"
+RENDER_THREADS = 0  # x264 threads per render (0 = auto); lower it when several renders run at once
 
-TMP_PROMPTS_JSON = Path("tmp_prompts.json")
+# Keep the LLM / TTS / SD models loaded in long-lived workers (see workers.py)
+# instead of starting a fresh interpreter per stage per story.
+USE_WORKERS = True
+TRACE = True  # write per-stage timings to traces/<run>.jsonl (summary: python tracing.py report)
+KEEP_WORKERS = False  # leave workers running after pipe.py exits (reuse on next run)
+
+# Pipelined scheduling: stories flow through the stages concurrently.
+# Concurrency per stage — keep GPU stages at 1, let CPU-bound encoding run in parallel.
+PIPELINED = True
+STAGE_CONCURRENCY = {"generate": 1, "tts": 1, "images": 1, "render": 2}
+QUEUE_SIZE = 2          # stories waiting in front of each stage
+GPU_STAGES = {"generate", "tts", "images"}
+SERIALIZE_GPU = False   # True: only one GPU stage at a time (small cards)
 
 # =========================
 # Helpers
@@ -53,6 +90,22 @@ def run_python(py_exe: str, args: List[str]) -> int:
     return subprocess.run([py_exe, *args], check=False).returncode
 
 
+def make_workers() -> dict:
+    if TORTOISE_ACTIVATE:
+        tts_cmd = ["bash", "-lc", f"{TORTOISE_ACTIVATE} && python {TORTOISE_GEN} --serve"]
+    else:
+        tts_cmd = [TORTOISE_PY, TORTOISE_GEN, "--serve"]
+    return {
+        "generator": WorkerClient("generator", [sys.executable, str(GENERATOR_SCRIPT), "--serve"]),
+        "tts": WorkerClient("tts", tts_cmd),
+        "imager": WorkerClient("imager", [IMAGER_PY, IMAGER, "--serve"]),
+    }
+
+
+WORKERS = make_workers() if USE_WORKERS else {}
+JOBS = JobStore()
+
+
 def list_pairs(out_dir: Path) -> List[Tuple[Path, Path]]:
     """Return list of (narration_path, images_path) pairs sorted by mtime desc."""
     narr = list(out_dir.glob("*_narration.txt"))
@@ -84,50 +137,283 @@ def read_image_prompts(images_path: Path) -> List[str]:
     return []
 
 
-def generate_one_story() -> Tuple[Path, Path]:
-    """Run the generator script once and return (narration_path, images_path) for the newest pair."""
+def generate_stories(count: int) -> List[Tuple[Path, Path]]:
+    """Run the generator once for `count` stories and return their (narration_path, images_path) pairs."""
+    if USE_WORKERS:
+        result = WORKERS["generator"].call(count=count)
+        return [(Path(st["narration"]), Path(st["images"])) for st in result["stories"]]
+
     before = {p.name for p in OUTPUT_DIR.glob("*.txt")}
     # Call the generator with your system python; the generator itself will use its own model env
-    code = run_python(sys.executable, [str(GENERATOR_SCRIPT)])
+    code = run_python(sys.executable, [str(GENERATOR_SCRIPT), "--count", str(count)])
     if code != 0:
         raise RuntimeError("Story generator failed")
     # Wait a moment for filesystem flush
     time.sleep(0.5)
-    # Find the newest pair that wasn't present before
+    # Find the newest pairs that weren't present before
     new_pairs = [pair for pair in list_pairs(OUTPUT_DIR)
                  if pair[0].name not in before and pair[1].name not in before]
     if new_pairs:
-        return new_pairs[0]
+        return new_pairs[:count]
     # Fallback: just take the newest pair overall
     pairs = list_pairs(OUTPUT_DIR)
     if not pairs:
         raise FileNotFoundError("No narration/images pair found in outputs/")
-    return pairs[0]
+    return pairs[:1]
 
 
-def make_video_from_pair(narr: Path, imgs: Path) -> None:
-    story_text = read_narration(narr)
-    pic_prompts = read_image_prompts(imgs)
+_PENDING_PAIRS: List[Tuple[Path, Path]] = []
+_PENDING_LOCK = threading.Lock()
 
-    # Save prompts to JSON for your imager step
-    TMP_PROMPTS_JSON.write_text(json.dumps(pic_prompts, ensure_ascii=False, indent=2), encoding="utf-8")
 
-    print(f"🔊 TTS for: {narr.name}")
-    if TORTOISE_ACTIVATE:
-        safe_story = story_text.replace("\\", "\\\\").replace('"', '\\"')
-        run_bash(f'{TORTOISE_ACTIVATE} && python {TORTOISE_GEN!s} "{safe_story}"')
+def generate_one_story(remaining: int = 1) -> Tuple[Path, Path]:
+    """Return the next (narration_path, images_path).
+
+    Stories are generated up to GENERATE_BATCH at a time, but never more than
+    the `remaining` stories this run still needs.
+    """
+    with _PENDING_LOCK:
+        if not _PENDING_PAIRS:
+            _PENDING_PAIRS.extend(generate_stories(max(1, min(GENERATE_BATCH, remaining))))
+        return _PENDING_PAIRS.pop(0)
+
+
+def check(code: int, what: str) -> None:
+    if code != 0:
+        raise RuntimeError(f"{what} failed with exit code {code}")
+
+
+# =========================
+# Stages (each takes and returns a story dict)
+# =========================
+def stage_generate(story: dict) -> dict:
+    narr, imgs = generate_one_story(story["total"] - story["index"] + 1)
+    print(f"Found outputs:\n  - {narr}\n  - {imgs}")
+    job = JOBS.create_job(narr, imgs)
+    story.update(job=job, dir=JOBS.workspace(job), narr=narr, imgs=imgs,
+                 text=read_narration(narr), prompts=read_image_prompts(imgs))
+    # The workspace keeps its own copy of the inputs, so the job can be resumed on its own
+    (story["dir"] / "narration.txt").write_text(story["text"], encoding="utf-8")
+    (story["dir"] / "prompts.json").write_text(json.dumps(story["prompts"], ensure_ascii=False, indent=2),
+                                               encoding="utf-8")
+    return story
+
+
+def stage_tts(story: dict, emit: Optional[Callable[[dict], None]] = None) -> dict:
+    """Synthesize the narration into <story dir>/voice/final_output.wav.
+
+    TTS streams the WAV chunk by chunk; with `emit` the story is handed to the
+    next stages as soon as the first chunk is on disk (they wait for the full
+    file via audio_stream.wait_for_audio), while this stage keeps its slot until
+    synthesis finishes.
+    """
+    print(f"🔊 TTS for: {story['narr'].name}")
+    voice_dir = story["dir"] / "voice"
+    wav = voice_dir / "final_output.wav"
+    clear_stream(wav)  # a resumed job may still have a failed or finished attempt on disk
+
+    def synthesize() -> None:
+        if USE_WORKERS:
+            WORKERS["tts"].call(text=story["text"], output_dir=str(voice_dir))
+        elif TORTOISE_ACTIVATE:
+            safe_story = story["text"].replace("\\", "\\\\").replace('"', '\\"')
+            check(run_bash(f'{TORTOISE_ACTIVATE} && python {TORTOISE_GEN!s} "{safe_story}" "{voice_dir}"'), "TTS")
+        else:
+            check(run_python(TORTOISE_PY, [TORTOISE_GEN, story["text"], str(voice_dir)]), "TTS")
+
+    if emit is None:
+        synthesize()
+        return story
+
+    errors = []
+
+    def run() -> None:
+        try:
+            synthesize()
+        except Exception as e:
+            errors.append(e)
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    while t.is_alive():
+        progress = read_progress(wav)
+        if progress and progress["chunks_done"] > 0:
+            emit(story)
+        t.join(1.0)
+    if errors:
+        mark_failed(wav)  # unblock stages already waiting on this audio
+        raise errors[0]
+    return story
+
+
+def stage_images(story: dict) -> dict:
+    print(f"🖼️  Generating images ({story['dir']})")
+    output_folder = story["dir"] / "images"
+    if USE_WORKERS:
+        tier = {"tier": IMAGE_TIER} if IMAGE_TIER else {}
+        WORKERS["imager"].call(prompts=story["prompts"], output_folder=str(output_folder),
+                               video_height=RENDER_HEIGHT, **tier)
     else:
-        run_python(TORTOISE_PY, [TORTOISE_GEN, story_text])
+        # The prompts were saved to the story's workspace by stage_generate
+        prompts_json = story["dir"] / "prompts.json"
+        check(run_python(IMAGER_PY, [IMAGER, str(prompts_json), str(output_folder)]), "Imager")
+    return story
+
+
+def stage_render(story: dict) -> dict:
+    print(f"🎞️  Rendering video ({story['dir']})")
+    # render.py usually runs in same env as tortoise; use explicit tortoise python to be safe
+    check(run_python(TORTOISE_PY, [RENDER, str(story["dir"])]), "render.py")
+    return story
+
+
+# Images only need the prompts, so they run while TTS is still streaming audio
+STAGES = [
+    ("generate", stage_generate),
+    ("tts", stage_tts),
+    ("images", stage_images),
+    ("render", stage_render),
+]
+HANDOFF_STAGES = {"tts"}  # stages that may pass a story on before they finish (see stage_tts)
+
+
+# Files each stage leaves in the story workspace; their hashes go to the job store
+STAGE_OUTPUTS = {
+    "generate": lambda d: [d / "narration.txt", d / "prompts.json"],
+    "tts": lambda d: [d / "voice" / "final_output.wav"],
+    "images": lambda d: sorted((d / "images").glob("*.png")),
+    "render": lambda d: [d / "Final.mp4"],
+}
+
 
-    print("✂️  Post-process audio")
-    # shorter.py usually runs in same env as tortoise; use explicit tortoise python to be safe
-    run_python(TORTOISE_PY, [SHORTER])
+def run_stage(name: str, fn: Callable[..., dict], story: dict, **kwargs) -> dict:
+    """Run one stage for a story, recording it in the job store.
 
-    print("🖼️  Generating images")
-    run_python(IMAGER_PY, [IMAGER, str(TMP_PROMPTS_JSON)])
+    A stage whose outputs are already recorded and unchanged (a resumed job) is skipped.
+    """
+    job = story.get("job")
+    if job and JOBS.stage_done(job, name):
+        print(f"⏭️  Story {story['index']}: {name} already done")
+        return story
+    if job:
+        JOBS.start_stage(job, name)
+    try:
+        with span(f"stage.{name}", story=story["index"], job=job):
+            story = fn(story, **kwargs)
+    except Exception as e:
+        if story.get("job"):
+            if not job:  # failed after stage_generate created the job
+                JOBS.start_stage(story["job"], name)
+            JOBS.fail_stage(story["job"], name, str(e))
+        raise
+    if not job:
+        JOBS.start_stage(story["job"], name)
+    JOBS.finish_stage(story["job"], name, STAGE_OUTPUTS[name](story["dir"]))
+    if name == STAGES[-1][0]:
+        JOBS.finish_job(story["job"])
+    return story
+
+
+def resume_story(job_id: str, index: int, total: int) -> dict:
+    """Story dict for an unfinished job, rebuilt from its workspace."""
+    JOBS.claim(job_id)
+    ws = JOBS.workspace(job_id)
+    return {"index": index, "total": total, "job": job_id, "dir": ws,
+            "narr": ws / "narration.txt", "imgs": ws / "prompts.json",
+            "text": read_narration(ws / "narration.txt"),
+            "prompts": json.loads((ws / "prompts.json").read_text(encoding="utf-8"))}
 
-    print("🎞️  Stacking frames to video")
-    run_python(TORTOISE_PY, [IMAGESTACK])
+
+def run_story(story: dict) -> dict:
+    for name, fn in STAGES:
+        story = run_stage(name, fn, story)
+    return story
+
+
+# =========================
+# Pipelined scheduler
+# =========================
+_STOP = object()
+
+
+def run_pipelined(stories: List[dict]) -> List[dict]:
+    """Run stories (new ones: {"index", "total"}, or resumed jobs) through STAGES concurrently.
+
+    Every stage has a bounded input queue and STAGE_CONCURRENCY[name] threads,
+    so story i+1 can be in TTS while story i renders images and story i-1 is
+    being encoded. A full queue blocks the stage in front of it. A story that
+    fails in one stage is reported and dropped; the rest of the batch goes on.
+    Returns the finished story dicts.
+    """
+    queues = [queue.Queue(maxsize=QUEUE_SIZE) for _ in STAGES]
+    done: List[dict] = []
+    failed: List[Tuple[int, str, str]] = []
+    lock = threading.Lock()
+    gpu_lock = threading.Lock()
+    alive = {name: STAGE_CONCURRENCY.get(name, 1) for name, _ in STAGES}
+
+    def worker(pos: int) -> None:
+        name, fn = STAGES[pos]
+        inbox = queues[pos]
+        outbox = queues[pos + 1] if pos + 1 < len(STAGES) else None
+
+        def forward(story: dict) -> None:
+            if outbox is not None:
+                outbox.put(story)
+            else:
+                print(f"✅ Story {story['index']} done: {story['dir'] / 'Final.mp4'}")
+                with lock:
+                    done.append(story)
+        while True:
+            story = inbox.get()
+            if story is _STOP:
+                break
+            handed_off = []
+
+            def emit(s: dict) -> None:
+                if not handed_off:
+                    handed_off.append(s)
+                    forward(s)
+
+            kwargs = {"emit": emit} if name in HANDOFF_STAGES else {}
+            try:
+                if SERIALIZE_GPU and name in GPU_STAGES:
+                    with gpu_lock:
+                        story = run_stage(name, fn, story, **kwargs)
+                else:
+                    story = run_stage(name, fn, story, **kwargs)
+            except Exception as e:
+                print(f"❌ Story {story['index']} failed in {name}: {e}")
+                with lock:
+                    failed.append((story["index"], name, str(e)))
+                continue
+            if not handed_off:
+                forward(story)
+        # The last thread of a stage to finish tells the next stage to stop
+        with lock:
+            alive[name] -= 1
+            last = alive[name] == 0
+        if last and outbox is not None:
+            for _ in range(alive[STAGES[pos + 1][0]]):
+                outbox.put(_STOP)
+
+    threads = []
+    for pos, (name, _) in enumerate(STAGES):
+        for k in range(alive[name]):
+            t = threading.Thread(target=worker, args=(pos,), name=f"{name}-{k}", daemon=True)
+            t.start()
+            threads.append(t)
+
+    for story in stories:
+        queues[0].put(story)
+    for _ in range(alive[STAGES[0][0]]):
+        queues[0].put(_STOP)
+    for t in threads:
+        t.join()
+
+    for index, name, err in failed:
+        print(f"⚠️ Story {index} failed in {name}: {err}")
+    return done
 
 
 # =========================
@@ -135,18 +421,45 @@ def make_video_from_pair(narr: Path, imgs: Path) -> None:
 # =========================
 if __name__ == "__main__":
     OUTPUT_DIR.mkdir(exist_ok=True)
+    if TTS_BUDGET_S:
+        os.environ["TTS_BUDGET"] = str(TTS_BUDGET_S)  # inherited by the TTS worker / script
+    if IMAGE_TIER:
+        os.environ["IMAGER_TIER"] = IMAGE_TIER  # for the imager worker and run_imager.py
+    os.environ["RENDER_HEIGHT"] = str(RENDER_HEIGHT)
+    os.environ["RENDER_BACKEND"] = RENDER_BACKEND
+    os.environ["RENDER_THREADS"] = str(RENDER_THREADS)
+    trace_path = new_trace_file() if TRACE else None  # inherited by every stage process
 
-    # How many stories to generate this run
-    n = 1
-    if len(sys.argv) > 1:
-        try:
-            n = max(1, int(sys.argv[1]))
-        except ValueError:
-            pass
-
-    for i in range(n):
-        print(f"\n============================\n🚀 Pipeline run {i+1}/{n}\n============================")
-        narr_path, img_path = generate_one_story()
-        print(f"Found outputs:\n  - {narr_path}\n  - {img_path}")
-        make_video_from_pair(narr_path, img_path)
-        print("✅ Done!\n")
+    ap = argparse.ArgumentParser(description="Generate stories and render them into shorts.")
+    ap.add_argument("count", nargs="?", type=int, default=None,
+                    help="new stories to generate (default: 1, or 0 with --resume)")
+    ap.add_argument("--resume", action="store_true",
+                    help="first finish the jobs of earlier runs that crashed or failed")
+    args = ap.parse_args()
+
+    resumed = JOBS.unfinished_jobs() if args.resume else []
+    resumed = [job for job in resumed if JOBS.stage_done(job, "generate")]
+    new = max(0, args.count if args.count is not None else (0 if args.resume else 1))
+    n = len(resumed) + new
+    if resumed:
+        print(f"♻️  Resuming {len(resumed)} unfinished job(s): {', '.join(resumed)}")
+    stories = [resume_story(job, i + 1, n) for i, job in enumerate(resumed)]
+    stories += [{"index": i + 1, "total": n} for i in range(len(resumed), n)]
+
+    try:
+        if PIPELINED:
+            print(f"\n============================\n🚀 Pipelined run of {n} stories\n============================")
+            finished = run_pipelined(stories)
+            print(f"✅ Done! {len(finished)}/{n} stories finished.\n")
+        else:
+            for story in stories:
+                print(f"\n============================\n🚀 Pipeline run {story['index']}/{n}\n============================")
+                story = run_story(story)
+                print(f"✅ Done! {story['dir'] / 'Final.mp4'}\n")
+    finally:
+        if trace_path:
+            print(f"⏱️  Stage timings written to {trace_path} (python tracing.py report)")
+        if not KEEP_WORKERS:
+            for worker in WORKERS.values():
+                if worker.proc is not None:  # only the ones this run started
+                    worker.shutdown()
@@ -0,0 +1,118 @@
+"""
+Pre-cropped 9:16 proxies of the background videos.
+
+Every story used to decode full-width 16:9 gameplay and throw away about two
+thirds of each frame in crop_center_9_16. build_proxies() transcodes each video
+in vids/ once into vids/proxies/: center-cropped to 9:16 with the same box,
+scaled to the render height, 30 fps, no audio, and a keyframe every second
+(-g 30), so segment starts snapped to keyframes are close together and a
+segment can be cut with stream copy.
+
+shorter.pick_segment() uses a video's proxy when it is built and up to date,
+and the original video otherwise (with a warning to build the missing ones).
+
+    python proxies.py [folder]     # build missing / outdated proxies, then index them
+"""
+
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+from video_index import VIDEO_FOLDER, VideoIndex, VideoInfo
+
+PROXY_DIRNAME = "proxies"
+PROXY_HEIGHT = int(os.environ.get("RENDER_HEIGHT", "1080"))
+PROXY_FPS = 30
+PROXY_GOP = 30  # frames between keyframes
+PROXY_CRF = 18  # near-transparent: the proxy is re-encoded once more by render.py
+FFMPEG = os.environ.get("FFMPEG", "ffmpeg")
+
+
+def crop_9_16_box(w: int, h: int) -> Tuple[int, int]:
+    """(x, width) of the centered 9:16 crop of a w x h frame (shorter.crop_center_9_16 uses it too)."""
+    new_w = int(h * 9 / 16)
+    x1 = w // 2 - new_w // 2
+    x2 = w // 2 + new_w // 2
+    return x1, x2 - x1
+
+
+def proxy_folder(video_folder=VIDEO_FOLDER) -> str:
+    return os.path.join(video_folder, PROXY_DIRNAME)
+
+
+def proxy_path(video_path: str, video_folder=VIDEO_FOLDER) -> str:
+    return os.path.join(proxy_folder(video_folder), os.path.splitext(os.path.basename(video_path))[0] + ".mp4")
+
+
+def proxy_current(video_path: str, video_folder=VIDEO_FOLDER) -> bool:
+    dst = proxy_path(video_path, video_folder)
+    return os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(video_path)
+
+
+def background_videos(index: VideoIndex, video_folder=VIDEO_FOLDER) -> List[VideoInfo]:
+    """Every background video, as its proxy when that is built and up to date, else as the original."""
+    index.refresh(video_folder)
+    folder = proxy_folder(video_folder)
+    if os.path.isdir(folder):
+        index.refresh(folder)
+    proxies = {v.path: v for v in index.videos(folder)}
+    videos, missing = [], []
+    for video in index.videos(video_folder):
+        proxy = proxies.get(os.path.normpath(proxy_path(video.path, video_folder)))
+        if proxy is not None and proxy_current(video.path, video_folder):
+            videos.append(proxy)
+        else:
+            videos.append(video)
+            missing.append(video.path)
+    if proxies and missing:
+        print(f"⚠️ {len(missing)} video(s) without an up-to-date proxy, using the originals "
+              f"(run python proxies.py): {', '.join(missing)}")
+    return videos
+
+
+def proxy_command(src: str, dst: str, width: int, height: int, threads: int = 0) -> List[str]:
+    x, crop_w = crop_9_16_box(width, height)
+    scale = "" if height == PROXY_HEIGHT else f",scale=-2:{PROXY_HEIGHT}:flags=lanczos"
+    cmd = [FFMPEG, "-y", "-loglevel", "error", "-i", src,
+           "-vf", f"crop={crop_w}:{height}:{x}:0{scale},fps={PROXY_FPS}",
+           "-an", "-c:v", "libx264", "-preset", "medium", "-crf", str(PROXY_CRF), "-pix_fmt", "yuv420p",
+           "-g", str(PROXY_GOP), "-keyint_min", str(PROXY_GOP), "-sc_threshold", "0",
+           "-movflags", "+faststart", "-f", "mp4"]
+    if threads:
+        cmd += ["-threads", str(threads)]
+    return cmd + [dst]
+
+
+def build_proxies(video_folder=VIDEO_FOLDER, threads: int = 0) -> int:
+    """Transcode new or changed videos into proxies (skips up-to-date ones). Returns proxies built."""
+    index = VideoIndex()
+    index.refresh(video_folder)
+    out_dir = proxy_folder(video_folder)
+    os.makedirs(out_dir, exist_ok=True)
+    built = 0
+    for video in index.videos(video_folder):
+        if proxy_current(video.path, video_folder):
+            continue
+        dst = proxy_path(video.path, video_folder)
+        print(f"🎞️  Building proxy {dst} ({video.width}x{video.height} -> 9:16 @ {PROXY_HEIGHT}p)")
+        tmp = dst + ".part"
+        result = subprocess.run(proxy_command(video.path, tmp, video.width, video.height, threads),
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed on {video.path}: {result.stderr.strip()[-2000:]}")
+        os.replace(tmp, dst)
+        built += 1
+    # Drop proxies whose source is gone
+    sources = {os.path.splitext(os.path.basename(v.path))[0] for v in index.videos(video_folder)}
+    for name in os.listdir(out_dir):
+        if name.endswith(".mp4") and os.path.splitext(name)[0] not in sources:
+            os.remove(os.path.join(out_dir, name))
+    index.refresh(out_dir)
+    return built
+
+
+if __name__ == "__main__":
+    folder = sys.argv[1] if len(sys.argv) > 1 else VIDEO_FOLDER
+    n = build_proxies(folder)
+    print(f"Built {n} proxy file(s) in {proxy_folder(folder)}")
@@ -0,0 +1,274 @@
+"""
+Single-pass short renderer.
+
+shorter.py encodes the cropped background with the narration to vid_no_pic.mp4,
+then imagestack.py decodes that file again, overlays the images and re-encodes
+it as Final.mp4. render.py plans one timeline (background segment, narration,
+image overlays) and composites it in a single pass from the source footage:
+the narration is read once and the video is encoded once.
+
+The timeline is saved next to the output (timeline.json) and reused by later
+renders of the same story while its narration and image set are unchanged.
+
+Backends ($RENDER_BACKEND):
+- ffmpeg:  the whole timeline as one ffmpeg filter graph (crop, scaled overlays
+           with alpha fades, audio), composited natively. Default.
+- segments: the ffmpeg graph per image-overlay segment, RENDER_JOBS segments
+           encoded in parallel and joined losslessly; see render_segments().
+- moviepy: the same timeline composited frame by frame in Python.
+All encode with libx264 at X264_PRESET using RENDER_THREADS threads.
+
+Usage: python render.py [story_dir]   (defaults to the latest timestamped dir)
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+from moviepy.config import get_setting
+from moviepy.editor import VideoFileClip, AudioFileClip, CompositeVideoClip
+
+from audio_stream import wait_for_audio, wav_duration
+from imagestack import FADE_S, OVERLAY_SCALE, list_images, overlay_clips, schedule_images
+from jobstore import get_latest_timestamped_dir
+from proxies import crop_9_16_box
+from shorter import TAIL_S, crop_center_9_16, pick_segment
+from tracing import span
+from video_index import VideoIndex
+
+FPS = 30
+BACKEND = os.environ.get("RENDER_BACKEND", "ffmpeg")
+RENDER_THREADS = int(os.environ.get("RENDER_THREADS", "0"))  # 0 = let x264 decide
+X264_PRESET = os.environ.get("X264_PRESET", "medium")
+RENDER_JOBS = int(os.environ.get("RENDER_JOBS", "0"))  # parallel segment encodes; 0 = one per CPU
+SEGMENT_DIRNAME = "segments"
+
+
+class Overlay(NamedTuple):
+    path: str
+    start: float
+    duration: float
+
+
+class Timeline(NamedTuple):
+    video_file: str
+    start: float           # offset of the segment in video_file
+    duration: float        # narration + TAIL_S
+    audio: str
+    audio_duration: float
+    overlays: List[Overlay]
+    output: str
+
+
+def plan(story_dir) -> Timeline:
+    """Pick the background segment and image order for a story."""
+    story_dir = Path(story_dir)
+    audio = story_dir / "voice" / "final_output.wav"
+    wait_for_audio(audio)  # TTS may still be streaming into the file
+    audio_duration = wav_duration(audio)
+    duration = audio_duration + TAIL_S
+    video_file, start = pick_segment(duration)
+    overlays = [Overlay(*o) for o in schedule_images(list_images(story_dir / "images"), duration)]
+    return Timeline(video_file, start, duration, str(audio), audio_duration, overlays,
+                    str(story_dir / "Final.mp4"))
+
+
+def load_timeline(story_dir) -> Optional[Timeline]:
+    """The story's saved timeline, if it still matches its narration and images."""
+    path = Path(story_dir) / "timeline.json"
+    if not path.exists():
+        return None
+    d = json.loads(path.read_text(encoding="utf-8"))
+    tl = Timeline(**{**d, "overlays": [Overlay(*o) for o in d["overlays"]]})
+    wait_for_audio(tl.audio)
+    images = {str(p) for p in (Path(story_dir) / "images").glob("*.png")}
+    if (not os.path.exists(tl.video_file) or abs(wav_duration(tl.audio) - tl.audio_duration) > 1e-3
+            or {o.path for o in tl.overlays} != images):
+        return None
+    return tl
+
+
+def save_timeline(tl: Timeline) -> Path:
+    path = Path(tl.output).with_name("timeline.json")
+    path.write_text(json.dumps(tl._asdict(), indent=2), encoding="utf-8")
+    return path
+
+
+def render_moviepy(tl: Timeline) -> None:
+    clip = VideoFileClip(tl.video_file).subclip(tl.start, tl.start + tl.duration)
+    video = crop_center_9_16(clip)
+    audio = AudioFileClip(tl.audio)
+    audio = audio.set_duration(min(audio.duration, video.duration))
+    final = CompositeVideoClip([video, *overlay_clips(tl.overlays, video.size)]).set_audio(audio)
+    final.write_videofile(tl.output, codec="libx264", audio_codec="aac", fps=FPS,
+                          preset=X264_PRESET, threads=RENDER_THREADS or None)
+
+
+def _composite_graph(video_size, overlays: List[Overlay]) -> Tuple[List[str], List[str], str]:
+    """Image inputs and filter graph for input 0 (the background) with `overlays` on top.
+
+    Images are inputs 1..n. Returns (input args, filters, label of the composited video).
+    """
+    w, h = video_size
+    x, crop_w = crop_9_16_box(w, h)
+    overlay_h = int(h // OVERLAY_SCALE)
+    inputs = []
+    graph = [f"[0:v]setpts=PTS-STARTPTS,crop={crop_w}:{h}:{x}:0,fps={FPS}[v0]"]
+    for i, o in enumerate(overlays):
+        fade = min(FADE_S, o.duration / 2)
+        inputs += ["-loop", "1", "-framerate", str(FPS), "-t", f"{o.duration:.3f}", "-i", o.path]
+        graph.append(
+            f"[{i + 1}:v]scale=-1:{overlay_h}:flags=lanczos,format=rgba,"
+            f"fade=t=in:st=0:d={fade:.3f}:alpha=1,"
+            f"fade=t=out:st={o.duration - fade:.3f}:d={fade:.3f}:alpha=1,"
+            f"setpts=PTS-STARTPTS{o.start:+.3f}/TB[img{i}]")
+        graph.append(f"[v{i}][img{i}]overlay=(W-w)/2:(H-h)/2:eof_action=pass[v{i + 1}]")
+    return inputs, graph, f"v{len(overlays)}"
+
+
+def _x264_args(threads: int) -> List[str]:
+    args = ["-c:v", "libx264", "-preset", X264_PRESET, "-pix_fmt", "yuv420p", "-r", str(FPS)]
+    return args + ["-threads", str(threads)] if threads else args
+
+
+def _run_ffmpeg(cmd: List[str], what: str) -> None:
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg {what} failed: {result.stderr.strip()[-2000:]}")
+
+
+def ffmpeg_command(tl: Timeline, video_size) -> List[str]:
+    """One ffmpeg invocation rendering `tl`: same crop, overlays and fades as render_moviepy."""
+    image_inputs, graph, video = _composite_graph(video_size, tl.overlays)
+    audio_input = len(tl.overlays) + 1
+    graph.append(f"[{audio_input}:a]apad[a]")
+    return [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+            "-ss", f"{tl.start:.3f}", "-t", f"{tl.duration:.3f}", "-i", tl.video_file,
+            *image_inputs, "-i", tl.audio,
+            "-filter_complex", ";".join(graph),
+            "-map", f"[{video}]", "-map", "[a]", "-t", f"{tl.duration:.3f}",
+            *_x264_args(RENDER_THREADS), "-c:a", "aac", tl.output]
+
+
+def render_ffmpeg(tl: Timeline) -> None:
+    info = VideoIndex().get(tl.video_file)
+    _run_ffmpeg(ffmpeg_command(tl, (info.width, info.height)), "render")
+
+
+# --- Time-segmented rendering ---
+# The timeline is cut at the image-overlay boundaries. Each segment (one image
+# and its fades over a slice of the background) is encoded by its own ffmpeg
+# process, the segments are joined with the concat demuxer (-c copy, no
+# re-encode) and the narration is muxed on top. Segment files are named by a
+# hash of everything that goes into them, so re-rendering a story after one
+# image changed only re-encodes that image's segment.
+
+class Segment(NamedTuple):
+    first_frame: int
+    frames: int
+    overlays: List[Overlay]  # starts relative to the segment
+
+
+def split_segments(tl: Timeline) -> List[Segment]:
+    """Segments between overlay starts, on the FPS frame grid so they concatenate exactly."""
+    total = round(tl.duration * FPS)
+    cuts = sorted({0, *(round(o.start * FPS) for o in tl.overlays)} - {total})
+    segments = []
+    for k, first in enumerate(cuts):
+        end = cuts[k + 1] if k + 1 < len(cuts) else total
+        overlays = [Overlay(o.path, o.start - first / FPS, o.duration)
+                    for o in tl.overlays if first <= round(o.start * FPS) < end]
+        segments.append(Segment(first, end - first, overlays))
+    return segments
+
+
+def _file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def segment_key(tl: Timeline, seg: Segment, video_size) -> str:
+    st = os.stat(tl.video_file)
+    spec = {
+        "video": [os.path.abspath(tl.video_file), st.st_size, st.st_mtime, list(video_size)],
+        "start": round(tl.start + seg.first_frame / FPS, 3),
+        "frames": seg.frames,
+        "overlays": [[_file_digest(o.path), round(o.start, 3), round(o.duration, 3)] for o in seg.overlays],
+        "encode": [FPS, X264_PRESET, OVERLAY_SCALE, FADE_S],
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()[:20]
+
+
+def segment_command(tl: Timeline, seg: Segment, video_size, out: str, threads: int) -> List[str]:
+    image_inputs, graph, video = _composite_graph(video_size, seg.overlays)
+    return [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+            "-ss", f"{tl.start + seg.first_frame / FPS:.3f}", "-t", f"{seg.frames / FPS + 1:.3f}",
+            "-i", tl.video_file, *image_inputs,
+            "-filter_complex", ";".join(graph), "-map", f"[{video}]", "-frames:v", str(seg.frames),
+            *_x264_args(threads), "-an", "-f", "mp4", out]
+
+
+def render_segments(tl: Timeline) -> None:
+    info = VideoIndex().get(tl.video_file)
+    video_size = (info.width, info.height)
+    seg_dir = Path(tl.output).with_name(SEGMENT_DIRNAME)
+    seg_dir.mkdir(exist_ok=True)
+
+    segments = split_segments(tl)
+    paths = [seg_dir / f"{segment_key(tl, seg, video_size)}.mp4" for seg in segments]
+    todo = [(seg, path) for seg, path in zip(segments, paths) if not path.exists()]
+    cpus = os.cpu_count() or 1
+    jobs = max(1, min(len(todo), RENDER_JOBS or cpus))
+    threads = RENDER_THREADS or max(1, cpus // jobs)
+    print(f"🎞️  {len(segments)} segments, {len(segments) - len(todo)} cached, "
+          f"{jobs} in parallel x {threads} threads")
+
+    def encode(item):
+        seg, path = item
+        tmp = str(path) + ".part"
+        with span("render.segment", frames=seg.frames, threads=threads):
+            _run_ffmpeg(segment_command(tl, seg, video_size, tmp, threads), f"segment {path.name}")
+        os.replace(tmp, path)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:  # each job is its own ffmpeg process
+        list(pool.map(encode, todo))
+
+    concat_list = seg_dir / "concat.txt"
+    concat_list.write_text("".join(f"file '{p.resolve()}'\n" for p in paths), encoding="utf-8")
+    with span("render.concat", segments=len(paths)):
+        _run_ffmpeg([get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+                     "-f", "concat", "-safe", "0", "-i", str(concat_list), "-i", tl.audio,
+                     "-map", "0:v", "-map", "1:a", "-c:v", "copy", "-af", "apad", "-t", f"{tl.duration:.3f}",
+                     "-c:a", "aac", "-movflags", "+faststart", tl.output], "concat")
+
+    keep = {p.name for p in paths} | {concat_list.name}
+    for old in seg_dir.iterdir():  # segments of earlier versions of this story
+        if old.name not in keep:
+            old.unlink()
+
+
+BACKENDS = {"moviepy": render_moviepy, "ffmpeg": render_ffmpeg, "segments": render_segments}
+
+
+def render(story_dir, backend: str = BACKEND) -> str:
+    """Plan and render <story_dir>/Final.mp4 in one encode; returns its path.
+
+    A re-render keeps the saved timeline (same background segment and image
+    order) while it still fits, so the segments backend reuses what it can.
+    """
+    with span("render.plan"):
+        tl = load_timeline(story_dir) or plan(story_dir)
+        save_timeline(tl)
+    with span("render.encode", backend=backend, seconds=round(tl.duration, 2)):
+        BACKENDS[backend](tl)
+    return tl.output
+
+
+if __name__ == "__main__":
+    latest = Path(sys.argv[1]) if len(sys.argv) > 1 else get_latest_timestamped_dir()
+    print(f"🎬 Rendered {render(latest)}")
@@ -1,7 +1,17 @@
 import sys, json
-from imager import generate_images
+from imager import BASE_SEED, generate_images
 
-with open(sys.argv[1]) as f:
-    prompts = json.load(f)
+if sys.argv[1] == "--serve":
+    # Warm worker: the SD pipeline was loaded once by importing imager
+    from workers import serve
+    serve("imager", lambda job: {"output_folder": generate_images(
+        job["prompts"], output_folder=job.get("output_folder"),
+        batch_size=job.get("batch_size"), seed=job.get("seed", BASE_SEED),
+        tier=job.get("tier"), video_height=job.get("video_height"))})
+else:
+    with open(sys.argv[1]) as f:
+        prompts = json.load(f)
 
-generate_images(prompts)
+    # Optional second argument: output folder (default: latest timestamped dir).
+    # Tier and render height come from $IMAGER_TIER / $RENDER_HEIGHT (see imager.plan_size).
+    generate_images(prompts, output_folder=sys.argv[2] if len(sys.argv) > 2 else None)
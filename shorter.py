@@ -1,48 +1,46 @@
-import os
-import random
+import sys
 from moviepy.editor import VideoFileClip, AudioFileClip, CompositeVideoClip
 from pathlib import Path
 
-def get_latest_timestamped_dir(base_path='.'):
-    base = Path(base_path)
-    # Only select directories with purely numeric names of the correct length (e.g., 12 for 'YYYYMMDDHHMM')
-    timestamped_dirs = [d for d in base.iterdir() if d.is_dir() and d.name.isdigit() and len(d.name) == 12]
-    if not timestamped_dirs:
-        return None  # or raise an error if you want
+from audio_stream import wait_for_audio
+from jobstore import get_latest_timestamped_dir
+from proxies import background_videos, crop_9_16_box
+from tracing import span
+from video_index import VideoIndex
 
-    # Sort them by name (chronological order because of format)
-    latest_dir = max(timestamped_dirs, key=lambda d: d.name)
-    return latest_dir
-
-# Usage
-latest = get_latest_timestamped_dir()
 
 # === CONFIG ===
 VIDEO_FOLDER = 'vids'         # Folder where your 16:9 videos are
-VOICE_AUDIO = str(latest / 'voice' / 'final_output.wav')          # Your generated Tortoise output
-OUTPUT_FILE = str(latest / 'vid_no_pic.mp4')    # Final result
+TAIL_S = 2                    # seconds of background kept after the narration ends
+
+def pick_segment(duration, video_folder=VIDEO_FOLDER):
+    """(video file, start time) of a random `duration`-second window of a random background video.
+
+    Uses the metadata index (video_index.py): no file is opened, clips shorter
+    than `duration` are skipped and the start is snapped to a keyframe. A video
+    whose pre-cropped 9:16 proxy (proxies.py) is built is used through it.
+    """
+    with span("clip.select", duration=round(duration, 2)):
+        index = VideoIndex()
+        return index.pick_from(background_videos(index, video_folder), duration, video_folder)
 
 def crop_center_9_16(clip):
     """Crop 16:9 to vertical 9:16 (portrait) format."""
-    w, h = clip.size
-    new_w = int(h * 9 / 16)
-    x_center = w // 2
-    x1 = x_center - new_w // 2
-    x2 = x_center + new_w // 2
-    return clip.crop(x1=x1, x2=x2)
-
-def create_short():
-    audio = AudioFileClip(VOICE_AUDIO)
-    SHORT_DURATION = audio.duration + 2
-    # 1. Pick a random gameplay video
-    all_videos = [f for f in os.listdir(VIDEO_FOLDER) if f.endswith(('.mp4', '.mov', '.mkv'))]
-    video_file = os.path.join(VIDEO_FOLDER, random.choice(all_videos))
+    x, width = crop_9_16_box(*clip.size)
+    return clip.crop(x1=x, x2=x + width)
+
+def create_short(story_dir):
+    """Background clip with the narration: <story_dir>/vid_no_pic.mp4 (input of imagestack.py)."""
+    voice_audio = str(Path(story_dir) / 'voice' / 'final_output.wav')  # Your generated Tortoise output
+    output_file = str(Path(story_dir) / 'vid_no_pic.mp4')               # Final result
+
+    wait_for_audio(voice_audio)  # TTS may still be streaming into the file
+    audio = AudioFileClip(voice_audio)
+    short_duration = audio.duration + TAIL_S
+    # 1-2. Pick a random gameplay video and a random keyframe start time
+    video_file, start_time = pick_segment(short_duration)
     clip = VideoFileClip(video_file)
-
-    # 2. Pick a random start time
-    max_start = max(0, clip.duration - SHORT_DURATION)
-    start_time = random.uniform(0, max_start)
-    subclip = clip.subclip(start_time, start_time + SHORT_DURATION)
+    subclip = clip.subclip(start_time, start_time + short_duration)
 
     # 3. Convert to 9:16 crop
     vertical_clip = crop_center_9_16(subclip)
@@ -52,6 +50,10 @@ def create_short():
     final = vertical_clip.set_audio(audio)
 
     # 5. Export
-    final.write_videofile(OUTPUT_FILE, codec='libx264', audio_codec='aac', fps=30)
+    final.write_videofile(output_file, codec='libx264', audio_codec='aac', fps=30)
 
-create_short()
+if __name__ == "__main__":
+    # Usage: python shorter.py [story_dir]  (defaults to the latest timestamped dir)
+    # render.py does this and imagestack.py's overlays in a single encode.
+    latest = Path(sys.argv[1]) if len(sys.argv) > 1 else get_latest_timestamped_dir()
+    create_short(latest)
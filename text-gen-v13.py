@@ -7,9 +7,16 @@ YouTube Shorts Generator with Local LLaMA (v2)
 
 Dependencies:
     pip install transformers accelerate wikipedia-api sentence-transformers scikit-learn
+
+Offline (no network, e.g. render boxes): pass a local page snapshot
+    python text-gen-v13.py --snapshot wiki_snapshot.jsonl
+(or set WIKI_SNAPSHOT). See wiki_source.py for building one.
 """
 
 import os
+import copy
+import queue
+import argparse
 import sqlite3
 import pathlib
 import textwrap
@@ -17,12 +24,17 @@ from datetime import datetime, timedelta
 import random
 import hashlib
 import re
-from typing import List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
 
+import numpy as np
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
-import wikipediaapi
-from sentence_transformers import SentenceTransformer, util
+from transformers import AutoTokenizer, AutoModelForCausalLM, StoppingCriteria, StoppingCriteriaList
+from sentence_transformers import SentenceTransformer
+
+from tracing import span
+from wiki_source import make_page_source
 
 # =========================
 # Config
@@ -33,15 +45,22 @@ DTYPE = torch.float16 if torch.cuda.is_available() else torch.float32
 MAX_NEW_TOKENS = 768
 TEMPERATURE = 0.8
 TOP_P = 0.9
+BATCH_SIZE = 4  # prompts per generate() call in batched mode
+PREFIX_CACHE = True  # reuse the KV cache of the constant system prompts across calls
+NUM_CANDIDATES = 3  # drafts sampled per story in one pass; 1 = draft + sequential rewrites
 
 OUTPUT_DIR = "outputs"
 DB_PATH = "memory.sqlite"
 EMB_MODEL = "all-MiniLM-L6-v2"
-PAST_K = 50
 SIM_THRESHOLD = 0.86
 MIN_WORDS = 300
 MAX_WORDS = 500
 TOPIC_COOLDOWN_DAYS = 30
+WIKI_SNAPSHOT = os.environ.get("WIKI_SNAPSHOT")  # local JSONL snapshot => fully offline
+PREFETCH_DEPTH = 4  # ready (topic, fact block) pairs kept ahead of the LLM
+PREFETCH_WORKERS = 8  # candidate topics checked / fetched at once
+PREFETCH_RETRY_S = 10  # pause before retrying when every lookup of a pass failed (e.g. offline)
+PREFETCH_MAX_FAILED_PASSES = 3  # ... and give up (take() raises) after this many such passes in a row
 
 # Expanded pool of diverse topics
 SEED_TOPICS = [
@@ -97,33 +116,35 @@ def connect_db():
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         created_at TEXT,
         topic TEXT,
-        text TEXT
+        text TEXT,
+        embedding BLOB
     )""")
+    # Older databases predate the embedding column
+    cols = {r[1] for r in cur.execute("PRAGMA table_info(scripts)")}
+    if "embedding" not in cols:
+        cur.execute("ALTER TABLE scripts ADD COLUMN embedding BLOB")
     con.commit()
     return con
 
-def get_recent_texts(con, k=PAST_K):
-    cur = con.cursor()
-    cur.execute("SELECT text FROM scripts ORDER BY id DESC LIMIT ?", (k,))
-    return [r[0] for r in cur.fetchall()]
-
 def get_recent_topics(con, days=TOPIC_COOLDOWN_DAYS):
     cutoff = datetime.utcnow() - timedelta(days=days)
     cur = con.cursor()
     cur.execute("SELECT topic FROM scripts WHERE created_at > ?", (cutoff.isoformat(),))
     return {r[0] for r in cur.fetchall()}
 
-def save_script(con, topic, text):
+def save_script(con, topic, text, embedding=None):
     cur = con.cursor()
+    blob = None if embedding is None else np.asarray(embedding, dtype=np.float32).tobytes()
     cur.execute(
-        "INSERT INTO scripts(created_at, topic, text) VALUES(?,?,?)",
-        (datetime.utcnow().isoformat(), topic, text),
+        "INSERT INTO scripts(created_at, topic, text, embedding) VALUES(?,?,?,?)",
+        (datetime.utcnow().isoformat(), topic, text, blob),
     )
     con.commit()
 
 def save_to_file(topic, narration, img_prompts, idx=1):
-    ts = datetime.now().strftime("%Y-%m-%d_%H-%M")
-    base = f"{ts}_{hashlib.sha256(topic.encode()).hexdigest()[:10]}"
+    ts = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    # idx keeps stories of one batch apart even if they share a topic
+    base = f"{ts}_{hashlib.sha256(topic.encode()).hexdigest()[:10]}_{idx}"
     narr_path = os.path.join(OUTPUT_DIR, f"{base}_narration.txt")
     img_path = os.path.join(OUTPUT_DIR, f"{base}_images.txt")
     # Only save the sanitized narration
@@ -137,25 +158,28 @@ def save_to_file(topic, narration, img_prompts, idx=1):
 # =========================
 # Wikipedia RAG helpers
 # =========================
-def pick_topic(wiki, con):
-    recent = get_recent_topics(con)
-    random.shuffle(SEED_TOPICS)
-    for t in SEED_TOPICS:
-        if t not in recent and wiki.page(t).exists():
-            return t
-    return random.choice(SEED_TOPICS)
+# `wiki` is a page source from wiki_source.py (cached online or offline snapshot)
+def pick_topic(wiki, con, exclude=()):
+    with span("text.pick_topic") as attrs:
+        recent = get_recent_topics(con) | set(exclude)
+        random.shuffle(SEED_TOPICS)
+        for checked, t in enumerate(SEED_TOPICS, 1):
+            if t not in recent and wiki.exists(t):
+                attrs["checked"] = checked
+                return t
+        # Every topic is in cooldown: repeat an old one, but not one already in this batch
+        return random.choice([t for t in SEED_TOPICS if t not in exclude] or SEED_TOPICS)
 
 def wiki_passages(wiki, title, max_passages=5):
-    page = wiki.page(title)
-    if not page.exists():
+    page = wiki.get(title)
+    if page is None:
         return []
     chunks = []
     if page.summary:
         chunks.append(page.summary)
-    for section in page.sections:
+    for text in page.sections:
         if len(chunks) >= max_passages:
             break
-        text = section.text
         if 350 < len(text) < 1200:
             chunks.append(text)
     return chunks[:max_passages]
@@ -172,24 +196,199 @@ def build_fact_block(passages, limit_chars=1600):
             break
     return "\n".join(f"- {textwrap.shorten(p, width=400, placeholder=' ...')}" for p in combined)
 
+class TopicPrefetcher:
+    """Keeps up to `depth` ready (topic, fact_block) pairs in a bounded queue.
+
+    A background thread walks the shuffled topics that are out of cooldown,
+    looks up `workers` of them at once (page check, fetch and fact block in
+    one wiki.get), and queues the ones with passages. The LLM side only
+    pops finished pairs, so it never waits on Wikipedia once the queue is
+    full. When every topic is in cooldown it falls back to random topics,
+    like pick_topic. A failed lookup (network error) is logged and the topic
+    is retried on a later pass; after PREFETCH_MAX_FAILED_PASSES passes in a
+    row where every lookup failed the thread stops and take() raises the
+    last error.
+    """
+    def __init__(self, wiki, recent=(), depth: int = PREFETCH_DEPTH, workers: int = PREFETCH_WORKERS):
+        self.wiki = wiki
+        self.workers = workers
+        self.ready = queue.Queue(maxsize=depth)
+        self._claimed = set(recent)  # in cooldown, queued or handed out
+        self._empty = set()          # topics without usable passages
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._error = None  # why the thread stopped, re-raised by take()
+        self._thread = threading.Thread(target=self._run, name="topic-prefetch", daemon=True)
+        self._thread.start()
+
+    def _fact_block(self, topic: str):
+        """Fact block for `topic`; None when it has no passages, the exception when the lookup failed."""
+        try:
+            with span("text.fact_block", topic=topic):
+                passages = wiki_passages(self.wiki, topic, max_passages=5)
+                return build_fact_block(passages) if passages else None
+        except Exception as e:
+            print(f"⚠️ Prefetch of '{topic}' failed, will retry: {e}")
+            return e
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self.ready.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        try:
+            failed_passes = 0
+            with ThreadPoolExecutor(self.workers, thread_name_prefix="topic-fetch") as pool:
+                while not self._stop.is_set():
+                    with self._lock:
+                        topics = [t for t in SEED_TOPICS if t not in self._claimed and t not in self._empty]
+                    random.shuffle(topics)
+                    if not topics:
+                        usable = [t for t in SEED_TOPICS if t not in self._empty]
+                        if not usable:
+                            self._error = RuntimeError("No topic has usable Wikipedia passages")
+                            return
+                        topics = random.sample(usable, len(usable))  # everything is in cooldown
+                    fallback = topics[0] in self._claimed
+                    queued, error = 0, None
+                    for start in range(0, len(topics), self.workers):
+                        batch = topics[start:start + self.workers]
+                        for topic, block in zip(batch, pool.map(self._fact_block, batch)):
+                            if isinstance(block, Exception):
+                                error = block
+                                continue
+                            if block is None:
+                                self._empty.add(topic)
+                                continue
+                            with self._lock:
+                                self._claimed.add(topic)
+                            if not self._put((topic, block, fallback)):
+                                return
+                            queued += 1
+                    if error is not None and not queued:
+                        failed_passes += 1
+                        if failed_passes >= PREFETCH_MAX_FAILED_PASSES:
+                            self._error = error
+                            return
+                        self._stop.wait(PREFETCH_RETRY_S)
+                    elif queued:
+                        failed_passes = 0
+        except Exception as e:
+            self._error = e
+
+    def take(self, count: int, recent=()) -> List[Tuple[str, str]]:
+        """Next `count` ready pairs on distinct topics.
+
+        Pairs whose topic entered cooldown meanwhile (`recent`) are dropped.
+        """
+        recent = set(recent)
+        with self._lock:
+            self._claimed |= recent
+        items, repeats = [], 0
+        with span("text.topic_wait", stories=count) as attrs:
+            while len(items) < count:
+                try:
+                    topic, block, fallback = self.ready.get(timeout=1.0)
+                except queue.Empty:
+                    if not self._thread.is_alive():
+                        raise self._error or RuntimeError("Topic prefetcher has stopped")
+                    continue
+                if topic in [t for t, _ in items]:
+                    # Fallback topics repeat once every topic is in cooldown
+                    repeats += 1
+                    if repeats > len(SEED_TOPICS):
+                        raise RuntimeError(f"Only {len(items)} topics have usable passages, {count} requested")
+                    continue
+                if fallback or topic not in recent:
+                    items.append((topic, block))
+            attrs["queued"] = self.ready.qsize()
+        return items
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+
 # =========================
 # Embedding-based similarity
 # =========================
 class SimilarityGuard:
-    def __init__(self, model_name: str):
+    """Duplicate check against the full script history.
+
+    Normalized embeddings live in the `embedding` column of `scripts` and are
+    loaded once into an (N, dim) matrix, so a lookup is a single dot product
+    instead of re-encoding past scripts on every run.
+    """
+    def __init__(self, model_name: str, con=None):
         self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.matrix = np.zeros((0, self.dim), dtype=np.float32)
+        if con is not None:
+            self.load(con)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        vecs = self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True)
+        return np.asarray(vecs, dtype=np.float32).reshape(len(texts), self.dim)
+
+    def load(self, con, batch_size: int = 64):
+        """Backfill missing/stale embeddings, then load every script's vector."""
+        cur = con.cursor()
+        rows = cur.execute("SELECT id, text, embedding FROM scripts").fetchall()
+        stale = [(i, t) for i, t, e in rows if e is None or len(e) != self.dim * 4]
+        for start in range(0, len(stale), batch_size):
+            batch = stale[start:start + batch_size]
+            vecs = self.encode([t or "" for _, t in batch])
+            cur.executemany(
+                "UPDATE scripts SET embedding = ? WHERE id = ?",
+                [(v.tobytes(), i) for (i, _), v in zip(batch, vecs)],
+            )
+        if stale:
+            con.commit()
+        blobs = [r[0] for r in cur.execute("SELECT embedding FROM scripts ORDER BY id")]
+        if blobs:
+            self.matrix = np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(-1, self.dim).copy()
+
+    def add(self, vec: np.ndarray):
+        self.matrix = np.vstack([self.matrix, np.asarray(vec, dtype=np.float32).reshape(1, self.dim)])
+
+    def most_similar(self, text: str) -> float:
+        return float(self.max_similarities([text])[0])
 
-    def most_similar(self, text: str, corpus: List[str]) -> float:
-        if not corpus:
-            return 0.0
-        v_new = self.model.encode([text], normalize_embeddings=True)
-        v_past = self.model.encode(corpus, normalize_embeddings=True)
-        sims = util.cos_sim(v_new, v_past)[0].cpu().tolist()
-        return max(sims)
+    def max_similarities(self, texts: List[str]) -> np.ndarray:
+        """Highest cosine similarity to any past script, for each text."""
+        if not len(self.matrix):
+            return np.zeros(len(texts), dtype=np.float32)
+        with span("text.similarity", texts=len(texts), history=len(self.matrix)):
+            return (self.encode(texts) @ self.matrix.T).max(axis=1)
 
 # =========================
 # Local LLM wrapper
 # =========================
+class DecodedTextStop(StoppingCriteria):
+    """Stop each row once `done(decoded_reply)` is true; checked every `every` tokens."""
+    def __init__(self, tokenizer, prompt_len: int, done: Callable[[str], bool], every: int = 4):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.done = done
+        self.every = every
+        self.steps = 0
+        self.finished = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.finished is None:
+            self.finished = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        self.steps += 1
+        if self.steps % self.every == 0:
+            texts = self.tokenizer.batch_decode(input_ids[:, self.prompt_len:], skip_special_tokens=True)
+            for i, text in enumerate(texts):
+                if not self.finished[i] and self.done(text):
+                    self.finished[i] = True
+        return self.finished.clone()
+
 class LocalChatModel:
     def __init__(self, model_id: str, device: str, dtype):
         self.tokenizer = AutoTokenizer.from_pretrained(model_id)
@@ -200,21 +399,117 @@ class LocalChatModel:
         )
         if self.tokenizer.pad_token_id is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
+        # system prompt -> (prefix token ids, past_key_values); the prompts are constants
+        self._prefix_cache = {}
 
     def chat(self, system_prompt: str, user_prompt: str,
              temperature: float = 0.8, top_p: float = 0.9,
              max_new_tokens: int = 512) -> str:
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
+        return self.chat_batch([(system_prompt, user_prompt)], temperature=temperature,
+                               top_p=top_p, max_new_tokens=max_new_tokens)[0]
+
+    def chat_batch(self, pairs: List[Tuple[str, str]],
+                   temperature: float = 0.8, top_p: float = 0.9,
+                   max_new_tokens: int = 512, batch_size: int = None,
+                   stop_when: Optional[Callable[[str], bool]] = None) -> List[str]:
+        """Answer several (system, user) prompts with one left-padded `generate` per batch.
+
+        `stop_when(reply_so_far)` ends a row early once the rest would be thrown away.
+        """
+        batch_size = batch_size or BATCH_SIZE
+        replies = []
+        for start in range(0, len(pairs), batch_size):
+            replies.extend(self._generate(pairs[start:start + batch_size], temperature, top_p,
+                                          max_new_tokens, stop_when))
+        return replies
+
+    def sample_candidates(self, pairs: List[Tuple[str, str]], k: int,
+                          batch_size: int = None, **kwargs) -> List[List[str]]:
+        """k sampled replies per prompt, all rows of a batch in one `generate` call.
+
+        Each prompt is repeated k times in the batch (same effect as
+        num_return_sequences=k, but keeps the shared system-prompt KV cache usable).
+        """
+        batch_size = (batch_size or BATCH_SIZE) * k
+        flat = self.chat_batch([p for p in pairs for _ in range(k)], batch_size=batch_size, **kwargs)
+        return [flat[i * k:(i + 1) * k] for i in range(len(pairs))]
+
+    def _system_prefix(self, system_prompt: str):
+        """(prefix_ids, past_key_values) for the chat-template prefix holding `system_prompt`, computed once."""
+        if system_prompt not in self._prefix_cache:
+            prefix = self.tokenizer.apply_chat_template(
+                [{"role": "system", "content": system_prompt}], tokenize=False
+            )
+            ids = self.tokenizer(prefix, return_tensors="pt")["input_ids"].to(self.model.device)
+            with torch.no_grad():
+                past = self.model(input_ids=ids, use_cache=True).past_key_values
+            self._prefix_cache[system_prompt] = (ids[0], past)
+        return self._prefix_cache[system_prompt]
+
+    def _prefixed_inputs(self, system_prompt: str, prompts: List[str]):
+        """Inputs that reuse the cached system-prompt KV, or None if the prompts don't start with it.
+
+        Rows are laid out as prefix + padding + suffix (padding masked out), so
+        every row shares the same cached prefix and only the suffix is prefilled.
+        """
+        prefix_ids, past = self._system_prefix(system_prompt)
+        n = prefix_ids.shape[0]
+        suffixes = []
+        for prompt in prompts:
+            ids = self.tokenizer(prompt, return_tensors="pt")["input_ids"][0].to(self.model.device)
+            if ids.shape[0] <= n or not torch.equal(ids[:n], prefix_ids):
+                return None
+            suffixes.append(ids[n:])
+        width = max(x.shape[0] for x in suffixes)
+        pad_id = self.tokenizer.pad_token_id
+        input_ids, attention_mask = [], []
+        for x in suffixes:
+            pad = width - x.shape[0]
+            input_ids.append(torch.cat([prefix_ids, x.new_full((pad,), pad_id), x]))
+            attention_mask.append(torch.cat([
+                x.new_ones(n), x.new_zeros(pad), x.new_ones(x.shape[0])
+            ]))
+        past = copy.deepcopy(past)
+        if hasattr(past, "batch_repeat_interleave"):
+            past.batch_repeat_interleave(len(prompts))
+        else:
+            past = tuple(tuple(t.repeat_interleave(len(prompts), dim=0) for t in layer) for layer in past)
+        return {
+            "input_ids": torch.stack(input_ids),
+            "attention_mask": torch.stack(attention_mask),
+            "past_key_values": past,
+        }
+
+    def _generate(self, pairs, temperature, top_p, max_new_tokens, stop_when=None) -> List[str]:
+        with span("llm.generate", prompts=len(pairs), max_new_tokens=max_new_tokens) as attrs:
+            return self._generate_batch(pairs, temperature, top_p, max_new_tokens, stop_when, attrs)
+
+    def _generate_batch(self, pairs, temperature, top_p, max_new_tokens, stop_when, attrs) -> List[str]:
+        prompts = [
+            self.tokenizer.apply_chat_template(
+                [{"role": "system", "content": system_prompt},
+                 {"role": "user", "content": user_prompt}],
+                tokenize=False, add_generation_prompt=True
+            )
+            for system_prompt, user_prompt in pairs
         ]
-        prompt = self.tokenizer.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True
-        )
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+        inputs = None
+        systems = {system_prompt for system_prompt, _ in pairs}
+        if PREFIX_CACHE and len(systems) == 1:
+            inputs = self._prefixed_inputs(systems.pop(), prompts)
+        if inputs is None:
+            # Decoder-only models must be padded on the left so every row ends at its prompt
+            self.tokenizer.padding_side = "left"
+            inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.model.device)
+        stopping = None
+        if stop_when is not None:
+            stopping = StoppingCriteriaList([
+                DecodedTextStop(self.tokenizer, inputs["input_ids"].shape[1], stop_when)
+            ])
         with torch.no_grad():
             outputs = self.model.generate(
                 **inputs,
+                stopping_criteria=stopping,
                 do_sample=True,
                 temperature=temperature,
                 top_p=top_p,
@@ -222,10 +517,9 @@ class LocalChatModel:
                 eos_token_id=self.tokenizer.eos_token_id,
                 pad_token_id=self.tokenizer.pad_token_id,
             )
-        text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-        if prompt in text:
-            text = text[len(prompt):]
-        return text.strip()
+        new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+        attrs["new_tokens"] = int(new_tokens.shape[1])
+        return [t.strip() for t in self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)]
 
 # =========================
 # Sanitizers
@@ -298,6 +592,22 @@ def enforce_word_range(text: str, min_words: int, max_words: int) -> str:
         return " ".join(words[:max_words])
     return text
 
+_SENTENCE_END = re.compile(r"[.!?][\"')\u201d\u2019]?(\s|$)")
+_LAST_ITEM_DONE = re.compile(r"^\s*10\.\s+\S.*\n", re.MULTILINE)
+
+def narration_complete(text: str) -> bool:
+    """A sentence has ended at or after word MAX_WORDS: anything further is cut by enforce_word_range.
+
+    Looks at the whole tail past MAX_WORDS, not just the last token, because
+    DecodedTextStop only checks every few tokens.
+    """
+    words = sanitize_narration(text).split()
+    return len(words) >= MAX_WORDS and bool(_SENTENCE_END.search(" ".join(words[MAX_WORDS - 1:])))
+
+def image_list_complete(text: str) -> bool:
+    """Item 10 is written out; parse_numbered_list ignores everything after it."""
+    return bool(_LAST_ITEM_DONE.search(text))
+
 def make_user_msg(topic: str, fact_block: str) -> str:
     return (
         f"Topic: {topic}\n"
@@ -305,26 +615,62 @@ def make_user_msg(topic: str, fact_block: str) -> str:
         f"Constraints: 300–500 words."
     )
 
+def generate_script_candidates(items: List[Tuple[str, str]], llm: LocalChatModel, k: int = 1) -> List[List[str]]:
+    """Draft k candidate scripts per (topic, fact_block) in batched generate calls."""
+    pairs = [(GEN_PROMPT, make_user_msg(topic, fact_block)) for topic, fact_block in items]
+    drafts = llm.sample_candidates(pairs, k, temperature=TEMPERATURE, top_p=TOP_P,
+                                   max_new_tokens=MAX_NEW_TOKENS, stop_when=narration_complete)
+    return [[sanitize_narration(d) for d in group] for group in drafts]
+
+def rewrite_script_candidates(items: List[Tuple[str, str]], llm: LocalChatModel, k: int = 1) -> List[List[str]]:
+    """Rewrite each (original, fact_block) into k candidates in batched generate calls."""
+    pairs = [(REWRITE_PROMPT, f"Facts:\n{fact_block}\n---\nOriginal script:\n{original}")
+             for original, fact_block in items]
+    rewrites = llm.sample_candidates(pairs, k, temperature=TEMPERATURE, top_p=TOP_P,
+                                     max_new_tokens=MAX_NEW_TOKENS, stop_when=narration_complete)
+    return [[sanitize_narration(r) for r in group] for group in rewrites]
+
+def generate_scripts(items: List[Tuple[str, str]], llm: LocalChatModel) -> List[str]:
+    """Draft one script per (topic, fact_block) in batched generate calls."""
+    return [group[0] for group in generate_script_candidates(items, llm)]
+
+def rewrite_scripts(items: List[Tuple[str, str]], llm: LocalChatModel) -> List[str]:
+    """Rewrite each (original, fact_block) in batched generate calls."""
+    return [group[0] for group in rewrite_script_candidates(items, llm)]
+
+def select_candidate(candidates: List[str], guard: SimilarityGuard) -> Tuple[str, bool]:
+    """Pick the best sample: in word range first, then least similar to past scripts.
+
+    Returns (script, ok) where ok means it passed both the length and similarity checks.
+    """
+    texts = [enforce_word_range(c, MIN_WORDS, MAX_WORDS) for c in candidates]
+    sims = guard.max_similarities(texts)
+    text, sim = min(zip(texts, sims), key=lambda ts: (word_count(ts[0]) < MIN_WORDS, ts[1]))
+    return text, word_count(text) >= MIN_WORDS and sim < SIM_THRESHOLD
+
+def generate_image_prompt_lists(topics: List[str], llm: LocalChatModel) -> List[List[str]]:
+    pairs = [(IMAGE_PROMPT_SYSTEM, f"Topic: {topic}") for topic in topics]
+    raws = llm.chat_batch(pairs, temperature=0.7, top_p=0.9, max_new_tokens=256,
+                          stop_when=image_list_complete)
+    lists = []
+    for topic, raw in zip(topics, raws):
+        prompts = parse_numbered_list(raw)
+        out = []
+        for p in prompts:
+            out.append(p if topic.lower() in p.lower() else f"{topic}: {p}")
+        while len(out) < 10:
+            out.append(f"{topic}: cinematic wide shot, detailed, high resolution")
+        lists.append(out[:10])
+    return lists
+
 def generate_script(topic: str, fact_block: str, llm: LocalChatModel) -> str:
-    user_msg = make_user_msg(topic, fact_block)
-    draft = llm.chat(GEN_PROMPT, user_msg, temperature=TEMPERATURE, top_p=TOP_P, max_new_tokens=MAX_NEW_TOKENS)
-    return sanitize_narration(draft)
+    return generate_scripts([(topic, fact_block)], llm)[0]
 
 def rewrite_script(original: str, fact_block: str, llm: LocalChatModel) -> str:
-    user_msg = f"Facts:\n{fact_block}\n---\nOriginal script:\n{original}"
-    rewrite = llm.chat(REWRITE_PROMPT, user_msg, temperature=TEMPERATURE, top_p=TOP_P, max_new_tokens=MAX_NEW_TOKENS)
-    return sanitize_narration(rewrite)
+    return rewrite_scripts([(original, fact_block)], llm)[0]
 
 def generate_image_prompts(topic: str, llm: LocalChatModel) -> List[str]:
-    user_msg = f"Topic: {topic}"
-    raw = llm.chat(IMAGE_PROMPT_SYSTEM, user_msg, temperature=0.7, top_p=0.9, max_new_tokens=256)
-    prompts = parse_numbered_list(raw)
-    out = []
-    for p in prompts:
-        out.append(p if topic.lower() in p.lower() else f"{topic}: {p}")
-    while len(out) < 10:
-        out.append(f"{topic}: cinematic wide shot, detailed, high resolution")
-    return out[:10]
+    return generate_image_prompt_lists([topic], llm)[0]
 
 # =========================
 # Variable format output
@@ -352,61 +698,146 @@ def format_image_prompt_list(var_name: str, prompts: List[str]) -> str:
 # =========================
 # MAIN
 # =========================
-def main():
-    ensure_dirs()
-    con = connect_db()
-    wiki = wikipediaapi.Wikipedia(
-        language="en",
-        user_agent="yt-short-rag/2.0 (contact: youremail@example.com)"
-    )
+def parse_args():
+    ap = argparse.ArgumentParser(description="Generate YouTube Shorts narration + image prompts")
+    ap.add_argument("--serve", action="store_true", help="run as a warm worker for pipe.py")
+    ap.add_argument("--count", type=int, default=1,
+                    help="generate this many stories in batched LLM passes")
+    ap.add_argument("--snapshot", default=WIKI_SNAPSHOT,
+                    help="read Wikipedia pages from this local JSONL snapshot (no network)")
+    return ap.parse_args()
+
+def make_wiki(snapshot=None):
+    return make_page_source(snapshot)
+
+def sequential_drafts(items: List[Tuple[str, str]], llm: LocalChatModel, guard: SimilarityGuard) -> List[str]:
+    """One draft per story, then up to two length rewrites and one similarity rewrite."""
+    drafts = [enforce_word_range(d, MIN_WORDS, MAX_WORDS) for d in generate_scripts(items, llm)]
+
+    for _ in range(2):
+        short = [i for i, d in enumerate(drafts) if word_count(d) < MIN_WORDS]
+        if not short:
+            break
+        rewrites = rewrite_scripts([(drafts[i], items[i][1]) for i in short], llm)
+        for i, r in zip(short, rewrites):
+            drafts[i] = enforce_word_range(r, MIN_WORDS, MAX_WORDS)
+
+    similar = [i for i, d in enumerate(drafts) if guard.most_similar(d) >= SIM_THRESHOLD]
+    if similar:
+        rewrites = rewrite_scripts([(drafts[i], items[i][1]) for i in similar], llm)
+        for i, r in zip(similar, rewrites):
+            drafts[i] = enforce_word_range(r, MIN_WORDS, MAX_WORDS)
+    return drafts
+
+def generate_stories(con, wiki, guard: SimilarityGuard, llm: LocalChatModel, count: int = 1,
+                     prefetcher: Optional[TopicPrefetcher] = None):
+    """Generate and save `count` stories on distinct topics with batched LLM calls.
+
+    Each step (draft, length rewrites, similarity rewrites, image prompts) is one
+    batched pass over all stories that need it, instead of count x 2–4 chats.
+    With NUM_CANDIDATES > 1 the drafts are sampled several at a time and the
+    best one is kept, so a rewrite pass is only needed when all of them fail.
+    Returns a list of (topic, narration, img_prompts, narr_path, img_path);
+    topics without Wikipedia passages are skipped, so it may be shorter than count.
+    With a `prefetcher` the topics and fact blocks come ready from its queue.
+    """
+    items = []
+    if prefetcher is not None:
+        items = prefetcher.take(count, get_recent_topics(con))
+    for _ in range(count - len(items)):
+        topic = pick_topic(wiki, con, exclude=[t for t, _ in items])
+        with span("text.fact_block", topic=topic):
+            passages = wiki_passages(wiki, topic, max_passages=5)
+            if passages:
+                items.append((topic, build_fact_block(passages)))
+    if not items:
+        return []
 
-    topic = pick_topic(wiki, con)
-    passages = wiki_passages(wiki, topic, max_passages=5)
-    if not passages:
-        print("No Wikipedia passages found. Try again.")
-        return
-    fact_block = build_fact_block(passages)
+    if NUM_CANDIDATES > 1:
+        # Sample several drafts per story at once; rewrite only when every one fails
+        picks = [select_candidate(c, guard) for c in generate_script_candidates(items, llm, NUM_CANDIDATES)]
+        drafts = [text for text, _ in picks]
+        failed = [i for i, (_, ok) in enumerate(picks) if not ok]
+        if failed:
+            rewrites = rewrite_script_candidates([(drafts[i], items[i][1]) for i in failed], llm, NUM_CANDIDATES)
+            for i, group in zip(failed, rewrites):
+                drafts[i] = select_candidate(group, guard)[0]
+    else:
+        drafts = sequential_drafts(items, llm, guard)
+
+    img_prompt_lists = generate_image_prompt_lists([topic for topic, _ in items], llm)
+
+    stories = []
+    for idx, ((topic, _), draft, img_prompts) in enumerate(zip(items, drafts, img_prompt_lists), 1):
+        embedding = guard.encode([draft])[0]
+        save_script(con, topic, draft, embedding)
+        guard.add(embedding)
+        narr_path, img_path = save_to_file(topic, draft, img_prompts, idx)
+        stories.append((topic, draft, img_prompts, narr_path, img_path))
+    return stories
+
+def generate_story(con, wiki, guard: SimilarityGuard, llm: LocalChatModel):
+    """Run one topic -> narration -> image prompts round and save it.
+
+    Returns (topic, narration, img_prompts, narr_path, img_path), or None when
+    no Wikipedia passages were found for the picked topic.
+    """
+    stories = generate_stories(con, wiki, guard, llm, count=1)
+    return stories[0] if stories else None
+
+def serve_worker(args):
+    """Keep the LLM and embedding model warm and generate one story per job."""
+    from workers import serve
 
-    guard = SimilarityGuard(EMB_MODEL)
+    ensure_dirs()
+    con = connect_db()
+    wiki = make_wiki(args.snapshot)
+    prefetcher = TopicPrefetcher(wiki, get_recent_topics(con))  # fills while the models load
+    guard = SimilarityGuard(EMB_MODEL, con)
     llm = LocalChatModel(MODEL_ID, DEVICE, DTYPE)
 
-    draft = generate_script(topic, fact_block, llm)
-    draft = enforce_word_range(draft, MIN_WORDS, MAX_WORDS)
+    def handle(job):
+        stories = generate_stories(con, wiki, guard, llm, count=job.get("count", 1), prefetcher=prefetcher)
+        if not stories:
+            raise RuntimeError("No Wikipedia passages found")
+        return {"stories": [{"topic": topic, "narration": narr_path, "images": img_path}
+                            for topic, _, _, narr_path, img_path in stories]}
 
-    attempts = 0
-    while word_count(draft) < MIN_WORDS and attempts < 2:
-        draft = enforce_word_range(rewrite_script(draft, fact_block, llm), MIN_WORDS, MAX_WORDS)
-        attempts += 1
+    serve("generator", handle)
 
-    past = get_recent_texts(con, PAST_K)
-    sim = guard.most_similar(draft, past)
-    if sim >= SIM_THRESHOLD:
-        draft = enforce_word_range(rewrite_script(draft, fact_block, llm), MIN_WORDS, MAX_WORDS)
+def main(args):
+    ensure_dirs()
+    con = connect_db()
+    wiki = make_wiki(args.snapshot)
+    prefetcher = TopicPrefetcher(wiki, get_recent_topics(con), depth=max(PREFETCH_DEPTH, args.count))
 
-    img_prompts = generate_image_prompts(topic, llm)
+    guard = SimilarityGuard(EMB_MODEL, con)
+    llm = LocalChatModel(MODEL_ID, DEVICE, DTYPE)
 
-    save_script(con, topic, draft)
-    narr_path, img_path = save_to_file(topic, draft, img_prompts)
+    stories = generate_stories(con, wiki, guard, llm, count=args.count, prefetcher=prefetcher)
+    prefetcher.close()
+    if not stories:
+        print("No Wikipedia passages found. Try again.")
+        return
 
-    print("\n=== TOPIC ===")
-    print(topic)
-    print("\n=== NARRATION (300–500 words) ===")
-    print(draft)
-    print("\n=== IMAGE PROMPTS ===")
-    for i, p in enumerate(img_prompts, 1):
-        print(f"{i}. {p}")
+    for idx, (topic, draft, img_prompts, narr_path, img_path) in enumerate(stories, 1):
+        print("\n=== TOPIC ===")
+        print(topic)
+        print("\n=== NARRATION (300–500 words) ===")
+        print(draft)
+        print("\n=== IMAGE PROMPTS ===")
+        for i, p in enumerate(img_prompts, 1):
+            print(f"{i}. {p}")
 
-    print("\n=== VARIABLE FORMAT OUTPUT ===")
-    print(format_story_variables(1, draft, img_prompts))
+        print("\n=== VARIABLE FORMAT OUTPUT ===")
+        print(format_story_variables(idx, draft, img_prompts))
 
-    print(f"\nSaved narration to: {narr_path}")
-    print(f"Saved image prompts to: {img_path}")
+        print(f"\nSaved narration to: {narr_path}")
+        print(f"Saved image prompts to: {img_path}")
 
-# def main():
-#     ensure_dirs()
-#     con = connect_db()
-#     recent_texts = get_recent_texts(con, PAST_K)
-#     print(recent_texts[0])
-    
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    if args.serve:
+        serve_worker(args)
+    else:
+        main(args)
\ No newline at end of file
@@ -1,19 +1,33 @@
 from tortoise.api import TextToSpeech
-from tortoise.utils.audio import load_voice
-import torchaudio
-import torch
 import re
 import sys
 import os
+import json
+import time
+import hashlib
+import multiprocessing
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
 from datetime import datetime
 from pathlib import Path
 
-# Initialize Tortoise
-tts = TextToSpeech()
-voice_samples, conditioning_latents = load_voice("daniel")
+from audio_stream import SAMPLE_RATE, StreamingWavWriter
+from tracing import set_trace_file, span, trace_file
+from tts_budget import PRESET_LADDER, PresetScheduler
+from voice_registry import VoiceRegistry
 
-# Your long input text
-text = sys.argv[1]
+VOICE = "daniel"
+PRESET = "high_quality"
+NUM_AUTOREGRESSIVE_SAMPLES = 12
+SEED = 0  # fixed seed: the same chunk always gives the same audio, so it can be cached
+CHUNK_CACHE_DIR = Path(".tts_cache")  # one float32 .npy per synthesized chunk
+# Per-story time budget in seconds; picks presets from tts_budget.PRESET_LADDER to meet it
+TTS_BUDGET = float(os.environ["TTS_BUDGET"]) if os.environ.get("TTS_BUDGET") else None
+# CPU-only hosts: synthesize chunks in TTS_WORKERS processes (0 = in this process),
+# each with its own warm TextToSpeech and TTS_THREADS torch threads (0 = cores / workers)
+TTS_WORKERS = int(os.environ.get("TTS_WORKERS", "0"))
+TTS_THREADS = int(os.environ.get("TTS_THREADS", "0"))
 
 # Helper: split by sentences while keeping them complete
 def split_into_chunks(text, max_chars=100):
@@ -31,35 +45,246 @@ def split_into_chunks(text, max_chars=100):
         chunks.append(current.strip())
     return chunks
 
-# Split text
-chunks = split_into_chunks(text)
+def load_tts():
+    """Initialize Tortoise once; returns (tts, voice registry).
 
-# Process each chunk
-final_audio = []
-for idx, chunk in enumerate(chunks):
-    print(f"🔹 Generating chunk {idx+1}/{len(chunks)}...")
-    try:
+    In process-pool mode (TTS_WORKERS > 0) the pool processes hold the models,
+    so tts is None here.
+    """
+    tts = TextToSpeech() if TTS_WORKERS == 0 else None
+    return tts, VoiceRegistry(tts)
+
+def chunk_key(chunk, voice_id, preset, num_samples, seed):
+    payload = json.dumps([chunk, voice_id, preset, num_samples, seed], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def chunk_path(chunk, voice_id, preset, num_samples, seed=SEED):
+    return CHUNK_CACHE_DIR / f"{chunk_key(chunk, voice_id, preset, num_samples, seed)}.npy"
+
+def cached_chunk(chunk, voice_id, tiers):
+    """(samples, preset, num_samples) for the best of `tiers` already in the cache, or None."""
+    for preset, num_samples in tiers:
+        path = chunk_path(chunk, voice_id, preset, num_samples)
+        if path.exists():
+            return np.load(path), preset, num_samples
+    return None
+
+def synthesize_chunk(tts, conditioning_latents, chunk, voice_id,
+                     preset=PRESET, num_samples=NUM_AUTOREGRESSIVE_SAMPLES, seed=SEED):
+    """Audio for one chunk as a float32 array; served from the chunk cache when possible."""
+    path = chunk_path(chunk, voice_id, preset, num_samples, seed)
+    if path.exists():
+        return np.load(path)
+    with span("tts.chunk", chars=len(chunk), preset=preset, samples=num_samples):
         audio = tts.tts_with_preset(
             text=chunk,
-            voice_samples=voice_samples,
+            voice_samples=None,  # cached latents from the voice registry
             conditioning_latents=conditioning_latents,
-            preset="high_quality",
-            num_autoregressive_samples=12,
+            preset=preset,
+            num_autoregressive_samples=num_samples,
+            use_deterministic_seed=seed,
         )
-        if audio is not None and audio.shape[-1] > 0:
-            final_audio.append(audio)
+    if audio is None:
+        return np.zeros(0, dtype=np.float32)
+    samples = audio.squeeze().detach().cpu().numpy().astype(np.float32).reshape(-1)
+    CHUNK_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp.npy")
+    np.save(tmp, samples)
+    os.replace(tmp, path)  # never leave a half-written entry behind
+    return samples
+
+def _chunks_serial(tts, conditioning_latents, chunks, voice_id, tiers, scheduler):
+    """Yield (samples, preset, num_samples, cached, seconds) for each chunk, in order."""
+    remaining_chars = sum(len(c) for c in chunks)
+    for idx, chunk in enumerate(chunks):
+        print(f"🔹 Generating chunk {idx+1}/{len(chunks)}...")
+        started = time.time()
+        hit = cached_chunk(chunk, voice_id, tiers)
+        if hit is not None:
+            samples, preset, num_samples = hit
         else:
-            print(f"⚠️ Skipped empty chunk {idx+1}")
-    except Exception as e:
-        print(f"❌ Failed at chunk {idx+1}: {e}")
-
-# Save final audio
-if final_audio:
-    combined = torch.cat(final_audio, dim=-1)
-    output_dir =Path(datetime.now().strftime("%Y%m%d%H%M")) / "voice"
-    output_dir.mkdir(parents=True, exist_ok=True)
+            preset, num_samples = scheduler.choose(remaining_chars) if scheduler else tiers[0]
+            for attempt in range(2):
+                try:
+                    samples = synthesize_chunk(tts, conditioning_latents, chunk, voice_id, preset, num_samples)
+                    break
+                except Exception as e:
+                    print(f"❌ Failed at chunk {idx+1} (attempt {attempt+1}): {e}")
+            else:
+                raise RuntimeError(f"TTS failed at chunk {idx+1}/{len(chunks)}; re-run to resume from the cache")
+            if scheduler:
+                scheduler.record(preset, len(chunk), time.time() - started)
+        remaining_chars -= len(chunk)
+        yield samples, preset, num_samples, hit is not None, time.time() - started
+
+# Parallel synthesis pool: created on first use and kept (with its warm models)
+# for every later story in this process
+_POOL = None
+_POOL_SHAPE = None
+_POOL_TTS = None  # the TextToSpeech inside each pool process
+
+def _init_pool_worker(threads):
+    global _POOL_TTS
+    import torch
+    torch.set_num_threads(threads)
+    _POOL_TTS = TextToSpeech()
+
+def _pool_synthesize_chunk(conditioning_latents, chunk, voice_id, preset, num_samples, trace=None):
+    set_trace_file(trace)  # pool processes outlive a single run
+    started = time.time()
+    samples = synthesize_chunk(_POOL_TTS, conditioning_latents, chunk, voice_id, preset, num_samples)
+    return samples, time.time() - started
+
+def get_pool(workers, threads):
+    global _POOL, _POOL_SHAPE
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+    if _POOL is None or _POOL_SHAPE != (workers, threads):
+        reset_pool()
+        print(f"🧵 Starting {workers} TTS processes x {threads} torch threads")
+        _POOL = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                    initializer=_init_pool_worker, initargs=(threads,))
+        _POOL_SHAPE = (workers, threads)
+    return _POOL
+
+def reset_pool():
+    global _POOL, _POOL_SHAPE
+    if _POOL is not None:
+        _POOL.shutdown(wait=False, cancel_futures=True)
+    _POOL, _POOL_SHAPE = None, None
+
+def _chunks_parallel(conditioning_latents, chunks, voice_id, tiers, scheduler, workers, threads):
+    """Like _chunks_serial, but spreads uncached chunks over a pool of warm TTS processes.
+
+    Up to 2 x workers chunks are in flight; results are yielded in chunk order.
+    """
+    remaining_chars = sum(len(c) for c in chunks)
+    futures, hits = {}, {}
+    try:
+        def submit(idx, attempt=0):
+            preset, num_samples = scheduler.choose(remaining_chars) if scheduler else tiers[0]
+            pool = get_pool(workers, threads)
+            future = pool.submit(_pool_synthesize_chunk, conditioning_latents, chunks[idx], voice_id,
+                                 preset, num_samples, trace_file())
+            futures[idx] = (future, pool, preset, num_samples, attempt)
+
+        next_submit = 0
+        for idx, chunk in enumerate(chunks):
+            while next_submit < len(chunks) and len(futures) < 2 * workers:
+                hit = cached_chunk(chunks[next_submit], voice_id, tiers)
+                if hit is not None:
+                    hits[next_submit] = hit
+                else:
+                    submit(next_submit)
+                next_submit += 1
+
+            print(f"🔹 Generating chunk {idx+1}/{len(chunks)}...")
+            if idx in hits:
+                samples, preset, num_samples = hits.pop(idx)
+                remaining_chars -= len(chunk)
+                yield samples, preset, num_samples, True, 0.0
+                continue
+            while True:
+                future, pool, preset, num_samples, attempt = futures.pop(idx)
+                try:
+                    samples, seconds = future.result()
+                    break
+                except Exception as e:
+                    if isinstance(e, (BrokenProcessPool, CancelledError)) and pool is not _POOL:
+                        # Read-ahead chunk of a pool that was already replaced: not its own failure
+                        submit(idx, attempt)
+                        continue
+                    print(f"❌ Failed at chunk {idx+1} (attempt {attempt+1}): {e}")
+                    if isinstance(e, BrokenProcessPool):
+                        reset_pool()  # a pool process died; start fresh ones for the retry
+                    if attempt:
+                        raise RuntimeError(f"TTS failed at chunk {idx+1}/{len(chunks)}; re-run to resume from the cache")
+                    submit(idx, attempt + 1)
+            if scheduler:
+                scheduler.record(preset, len(chunk), seconds)
+            remaining_chars -= len(chunk)
+            yield samples, preset, num_samples, False, seconds
+    finally:
+        for future, *_ in futures.values():
+            future.cancel()  # aborted story: don't keep the pool busy with its leftovers
+
+def synthesize(tts, conditioning_latents, text, voice_id=VOICE, output_dir=None, budget=TTS_BUDGET,
+               workers=TTS_WORKERS, threads=TTS_THREADS):
+    """Synthesize `text` into <output_dir>/final_output.wav and return its path.
+
+    Output_dir defaults to ./YYYYMMDDHHMM/voice. Each chunk is appended to the
+    WAV as soon as it is ready (see audio_stream.py), so memory stays flat and
+    downstream stages can watch final_output.progress.json.
+
+    Chunks already in the cache (same text, voice, preset, samples, seed) are not
+    synthesized again, so edited narrations only pay for the changed chunks and a
+    crashed run resumes where it stopped. A chunk that fails twice aborts the
+    story instead of leaving a gap in the narration.
+
+    With a `budget` (seconds) the preset of each remaining chunk is chosen by
+    tts_budget.PresetScheduler so the story finishes in time. The preset used
+    for every chunk is written to final_output.meta.json.
+
+    With `workers` > 0 chunks are synthesized in that many processes with
+    `threads` torch threads each (for CPU-only hosts); `tts` is then unused.
+    """
+    chunks = split_into_chunks(text)
+    output_dir = Path(output_dir) if output_dir else Path(datetime.now().strftime("%Y%m%d%H%M")) / "voice"
     output_path = output_dir / "final_output.wav"
-    torchaudio.save(str(output_path), combined.squeeze(0).cpu(), 24000)
-    print("✅ Saved to final_output.wav")
-else:
-    print("❌ No audio was successfully generated.")
+    scheduler = PresetScheduler(budget, parallelism=max(1, workers)) if budget else None
+    tiers = [(p, n) for p, n, _ in PRESET_LADDER] if scheduler else [(PRESET, NUM_AUTOREGRESSIVE_SAMPLES)]
+    if workers > 0:
+        results = _chunks_parallel(conditioning_latents, chunks, voice_id, tiers, scheduler, workers, threads)
+    else:
+        results = _chunks_serial(tts, conditioning_latents, chunks, voice_id, tiers, scheduler)
+    meta = []
+
+    # Process each chunk
+    with StreamingWavWriter(output_path, SAMPLE_RATE, total_chunks=len(chunks)) as writer:
+        for idx, (samples, preset, num_samples, cached, seconds) in enumerate(results):
+            if samples.shape[-1] == 0:
+                print(f"⚠️ Skipped empty chunk {idx+1}")
+            writer.write(samples)
+            meta.append({
+                "index": idx + 1,
+                "chars": len(chunks[idx]),
+                "preset": preset,
+                "num_autoregressive_samples": num_samples,
+                "cached": cached,
+                "seconds": round(seconds, 2),
+            })
+        if writer.frames == 0:
+            raise RuntimeError("No audio was successfully generated")
+
+    (output_dir / "final_output.meta.json").write_text(json.dumps({
+        "voice": voice_id,
+        "seed": SEED,
+        "budget": scheduler.summary() if scheduler else None,
+        "chunks": meta,
+    }, indent=2), encoding="utf-8")
+    print(f"✅ Saved to {output_path}")
+    return output_path
+
+def serve_worker():
+    """Keep Tortoise warm and synthesize {"text", "output_dir"?, "voice"?, "budget"?} jobs from pipe.py."""
+    from workers import serve
+
+    tts, voices = load_tts()
+    voices.latents(VOICE)
+
+    def handle(job):
+        voice = job.get("voice", VOICE)
+        output_path = synthesize(tts, voices.latents(voice), job["text"], voices.voice_id(voice),
+                                 job.get("output_dir"), job.get("budget", TTS_BUDGET))
+        return {"output_path": str(output_path)}
+
+    serve("tts", handle)
+
+if __name__ == "__main__":
+    if sys.argv[1] == "--serve":
+        serve_worker()
+    else:
+        # Your long input text, optionally followed by the output voice dir
+        text = sys.argv[1]
+        output_dir = sys.argv[2] if len(sys.argv) > 2 else None
+        tts, voices = load_tts()
+        synthesize(tts, voices.latents(VOICE), text, voices.voice_id(VOICE), output_dir)
@@ -0,0 +1,217 @@
+"""
+Per-stage instrumentation.
+
+Code wraps a unit of work in a span:
+
+    with span("tts.chunk", chars=len(chunk)):
+        ...
+
+When tracing is on, every finished span appends one JSON line to the run's
+trace file. Each line records the name, the parent span, wall time, CPU
+time, the RSS high-water mark, peak CUDA memory when torch is already loaded,
+and the span's attributes under "attrs" (so an attribute can never overwrite
+a measurement).
+
+CPU time is the span's own clock plus the child processes (ffmpeg, stage
+scripts) that exited during it. The own clock is the whole process in the
+main thread, so torch's intra-op threads count. In any other thread (pipe.py's
+scheduler threads, render segment threads) it is that thread only, so
+concurrent stories are not charged for each other's work. Child CPU comes
+from RUSAGE_CHILDREN, so spans that overlap in time can each include the
+same child.
+
+rss_hwm_mb is a high-water mark: the larger of this process's peak RSS since
+it started and that of its largest finished child. It is not a per-span
+peak. In a warm worker it only ever grows.
+
+Tracing is on when $TRACE_FILE is set: pipe.py sets it to traces/<run>.jsonl,
+so its subprocesses append to the same file, and warm workers get it with
+every job. With no trace file a span does nothing but time itself.
+
+Summarize one or more runs, with percentiles per span name:
+    python tracing.py report                  # every file in traces/
+    python tracing.py report traces/a.jsonl   # selected runs
+
+Named tracing.py, not trace.py, so it does not shadow the standard library module.
+Standard library only.
+"""
+
+import glob
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+TRACE_DIR = "traces"
+_local = threading.local()
+_write_lock = threading.Lock()
+
+
+def trace_file() -> Optional[str]:
+    return os.environ.get("TRACE_FILE") or None
+
+
+def set_trace_file(path: Optional[str]) -> None:
+    if path:
+        os.environ["TRACE_FILE"] = path
+    else:
+        os.environ.pop("TRACE_FILE", None)
+
+
+def new_trace_file(trace_dir: str = TRACE_DIR) -> str:
+    """Start a trace for this run (and the processes it starts); returns its path."""
+    os.makedirs(trace_dir, exist_ok=True)
+    path = os.path.join(trace_dir, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.jsonl")
+    set_trace_file(path)
+    return path
+
+
+def _rss_hwm_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS; children covers finished subprocesses
+    scale = 1 / (1024 * 1024) if sys.platform == "darwin" else 1 / 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) * scale, 1)
+
+
+def _cpu_clock():
+    if threading.current_thread() is threading.main_thread():
+        return "process", time.process_time
+    return "thread", time.thread_time
+
+
+def _children_cpu_s() -> float:
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return ru.ru_utime + ru.ru_stime
+
+
+def _cuda():
+    torch = sys.modules.get("torch")  # never import torch just for tracing
+    if torch is not None and torch.cuda.is_available():
+        return torch.cuda
+    return None
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a block; `attrs` (JSON-serialisable) are stored with the record.
+
+    The yielded dict can be updated inside the block to add attributes found
+    while running (e.g. a cache hit).
+    """
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    parent = stack[-1] if stack else None
+    stack.append(name)
+    cuda = _cuda()
+    if cuda is not None and not parent:
+        cuda.reset_peak_memory_stats()
+    clock_name, clock = _cpu_clock()
+    start, wall0, cpu0, child0 = time.time(), time.perf_counter(), clock(), _children_cpu_s()
+    ok = True
+    try:
+        yield attrs
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        stack.pop()
+        path = trace_file()
+        if path:
+            child_cpu = _children_cpu_s() - child0
+            record = {
+                "name": name,
+                "parent": parent,
+                "start": round(start, 3),
+                "wall_s": round(time.perf_counter() - wall0, 4),
+                "cpu_s": round(clock() - cpu0 + child_cpu, 4),
+                "child_cpu_s": round(child_cpu, 4),
+                "cpu_clock": clock_name,
+                "rss_hwm_mb": _rss_hwm_mb(),
+                "cuda_peak_mb": round(cuda.max_memory_allocated() / 2 ** 20, 1) if cuda is not None else None,
+                "pid": os.getpid(),
+                "ok": ok,
+                "attrs": attrs,
+            }
+            line = json.dumps(record, default=str) + "\n"
+            with _write_lock, open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+# =========================
+# Report
+# =========================
+def load(paths: List[str]) -> List[dict]:
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        pass  # torn line from a killed process
+    return records
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(records: List[dict]) -> Dict[str, dict]:
+    groups: Dict[str, List[dict]] = {}
+    for r in records:
+        groups.setdefault(r["name"], []).append(r)
+    summary = {}
+    for name, rs in groups.items():
+        wall = [r["wall_s"] for r in rs]
+        cuda = [r["cuda_peak_mb"] for r in rs if r.get("cuda_peak_mb") is not None]
+        summary[name] = {
+            "count": len(rs),
+            "failed": sum(not r.get("ok", True) for r in rs),
+            "total_s": sum(wall),
+            "p50_s": percentile(wall, 0.5),
+            "p90_s": percentile(wall, 0.9),
+            "p99_s": percentile(wall, 0.99),
+            "max_s": max(wall),
+            "cpu_s": sum(r["cpu_s"] for r in rs),
+            "rss_hwm_mb": max(r.get("rss_hwm_mb", r.get("peak_rss_mb", 0.0)) for r in rs),
+            "cuda_peak_mb": max(cuda) if cuda else None,
+        }
+    return summary
+
+
+def report(paths: List[str]) -> str:
+    summary = summarize(load(paths))
+    header = (f"{'span':<28}{'n':>6}{'fail':>5}{'total s':>10}{'p50 s':>9}{'p90 s':>9}{'p99 s':>9}"
+              f"{'max s':>9}{'cpu s':>9}{'rss hwm MB':>12}{'cuda MB':>9}")
+    lines = [f"{len(paths)} trace file(s)", header, "-" * len(header)]
+    for name, s in sorted(summary.items(), key=lambda kv: -kv[1]["total_s"]):
+        cuda = f"{s['cuda_peak_mb']:.0f}" if s["cuda_peak_mb"] is not None else "-"
+        lines.append(f"{name:<28}{s['count']:>6}{s['failed']:>5}{s['total_s']:>10.1f}{s['p50_s']:>9.2f}"
+                     f"{s['p90_s']:>9.2f}{s['p99_s']:>9.2f}{s['max_s']:>9.2f}{s['cpu_s']:>9.1f}"
+                     f"{s['rss_hwm_mb']:>12.0f}{cuda:>9}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "report":
+        files = sys.argv[2:] or sorted(glob.glob(os.path.join(TRACE_DIR, "*.jsonl")))
+        if not files:
+            sys.exit(f"No trace files in {TRACE_DIR}/")
+        print(report(files))
+    else:
+        print("usage: python tracing.py report [trace.jsonl ...]")
@@ -0,0 +1,67 @@
+"""
+Deadline-aware Tortoise quality selection.
+
+A story gets a time budget. Before each chunk the scheduler estimates how long
+the remaining text would take at every quality tier (seconds per character,
+measured on this host as chunks finish) and picks the best tier that still fits
+in the time left. On a fast GPU that stays at high_quality; on a CPU node it
+steps down towards fast as soon as the first timings come in.
+"""
+
+import time
+from typing import Dict, List, Tuple
+
+# Quality tiers, best first: (preset, num_autoregressive_samples, relative cost).
+# Relative costs are only priors; measured timings replace them per tier.
+PRESET_LADDER: List[Tuple[str, int, float]] = [
+    ("high_quality", 12, 1.0),
+    ("standard", 8, 0.5),
+    ("fast", 4, 0.15),
+]
+PRIOR_SEC_PER_CHAR = 0.5  # high_quality on a GPU, before anything has been measured
+
+
+class PresetScheduler:
+    def __init__(self, budget_s: float, ladder=PRESET_LADDER, prior_sec_per_char: float = PRIOR_SEC_PER_CHAR,
+                 parallelism: int = 1):
+        self.budget_s = budget_s
+        self.parallelism = parallelism  # chunks synthesized at once (process pool)
+        self.ladder = ladder
+        self.prior = prior_sec_per_char
+        self.start = time.time()
+        self._seconds: Dict[str, float] = {}
+        self._chars: Dict[str, int] = {}
+
+    def record(self, preset: str, chars: int, seconds: float) -> None:
+        """Feed back a measured (uncached) chunk synthesis."""
+        self._seconds[preset] = self._seconds.get(preset, 0.0) + seconds
+        self._chars[preset] = self._chars.get(preset, 0) + max(1, chars)
+
+    def sec_per_char(self, preset: str) -> float:
+        if preset in self._chars:
+            return self._seconds[preset] / self._chars[preset]
+        cost = {p: c for p, _, c in self.ladder}
+        # Scale from the best-measured tier by the relative cost priors
+        for p, _, c in self.ladder:
+            if p in self._chars:
+                return self._seconds[p] / self._chars[p] * cost[preset] / c
+        return self.prior * cost[preset]
+
+    def time_left(self) -> float:
+        return self.budget_s - (time.time() - self.start)
+
+    def choose(self, remaining_chars: int) -> Tuple[str, int]:
+        """(preset, num_autoregressive_samples) for the next chunk."""
+        left = self.time_left()
+        for preset, samples, _ in self.ladder:
+            if self.sec_per_char(preset) * remaining_chars / self.parallelism <= left:
+                return preset, samples
+        preset, samples, _ = self.ladder[-1]
+        return preset, samples
+
+    def summary(self) -> dict:
+        return {
+            "budget_s": self.budget_s,
+            "elapsed_s": round(time.time() - self.start, 2),
+            "sec_per_char": {p: round(self.sec_per_char(p), 4) for p, _, _ in self.ladder},
+        }
@@ -0,0 +1,168 @@
+"""
+Metadata index of the background video library (vids/).
+
+For every video the index keeps duration, resolution, fps, codec and the
+keyframe timestamps, read once with ffprobe and stored in SQLite. refresh()
+only re-probes files whose size or mtime changed and drops deleted ones, so
+picking a background segment costs a directory listing and no decoding.
+
+Segments start on a keyframe, so seeking to them never decodes from a keyframe
+far before the cut, and clips shorter than the narration are skipped.
+
+    python video_index.py [folder]     # refresh and list the index
+"""
+
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+from typing import List, NamedTuple, Tuple
+
+INDEX_PATH = "video_index.sqlite"
+VIDEO_FOLDER = "vids"
+VIDEO_EXTS = (".mp4", ".mov", ".mkv")
+FFPROBE = os.environ.get("FFPROBE", "ffprobe")
+
+
+class VideoInfo(NamedTuple):
+    path: str
+    duration: float
+    width: int
+    height: int
+    fps: float
+    codec: str
+    keyframes: List[float]
+
+
+def _ffprobe(args: List[str]) -> str:
+    try:
+        result = subprocess.run([FFPROBE, "-v", "error", *args], capture_output=True, text=True)
+    except FileNotFoundError:
+        raise RuntimeError(f"{FFPROBE} not found; install ffmpeg or set $FFPROBE")
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed on {args[-1]}: {result.stderr.strip()}")
+    return result.stdout
+
+
+def probe(path: str) -> VideoInfo:
+    """Stream metadata and keyframe times of the first video stream (packet flags only, no decoding)."""
+    meta = json.loads(_ffprobe([
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,r_frame_rate,codec_name:format=duration",
+        "-of", "json", path]))
+    stream = meta["streams"][0]
+    num, den = stream.get("r_frame_rate", "0/1").split("/")
+    keyframes = []
+    for line in _ffprobe(["-select_streams", "v:0", "-show_entries", "packet=pts_time,flags",
+                          "-of", "csv=p=0", path]).splitlines():
+        pts, _, flags = line.partition(",")
+        if "K" in flags and pts not in ("", "N/A"):
+            keyframes.append(float(pts))
+    return VideoInfo(path, float(meta["format"]["duration"]), int(stream["width"]), int(stream["height"]),
+                     float(num) / float(den) if float(den) else 0.0, stream.get("codec_name", ""),
+                     sorted(keyframes))
+
+
+class VideoIndex:
+    def __init__(self, index_path: str = INDEX_PATH):
+        self.con = sqlite3.connect(index_path, timeout=30)
+        self.con.execute("""
+        CREATE TABLE IF NOT EXISTS videos(
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime REAL,
+            duration REAL,
+            width INTEGER,
+            height INTEGER,
+            fps REAL,
+            codec TEXT,
+            keyframes TEXT
+        )""")
+        self.con.commit()
+
+    def _store(self, path: str, st: os.stat_result) -> VideoInfo:
+        info = probe(path)
+        self.con.execute(
+            "INSERT OR REPLACE INTO videos VALUES(?,?,?,?,?,?,?,?,?)",
+            (path, st.st_size, st.st_mtime, info.duration, info.width, info.height, info.fps,
+             info.codec, json.dumps(info.keyframes)),
+        )
+        return info
+
+    def refresh(self, folder=VIDEO_FOLDER) -> int:
+        """Probe new or changed videos in `folder`, forget removed ones. Returns files probed."""
+        seen, probed = set(), 0
+        for name in sorted(os.listdir(folder)):
+            if not name.endswith(VIDEO_EXTS):
+                continue
+            path = os.path.normpath(os.path.join(folder, name))  # "./vids", "vids/" -> "vids/..."
+            st = os.stat(path)
+            seen.add(path)
+            row = self.con.execute("SELECT size, mtime FROM videos WHERE path = ?", (path,)).fetchone()
+            if row and row[0] == st.st_size and row[1] == st.st_mtime:
+                continue
+            print(f"🔎 Indexing {path}")
+            self._store(path, st)
+            probed += 1
+        for v in self.videos(folder):
+            if v.path not in seen:
+                self.con.execute("DELETE FROM videos WHERE path = ?", (v.path,))
+        self.con.commit()
+        return probed
+
+    def videos(self, folder=VIDEO_FOLDER, min_duration: float = 0.0) -> List[VideoInfo]:
+        """Indexed videos directly inside `folder` (not in subfolders such as proxies/)."""
+        rows = self.con.execute(
+            "SELECT path, duration, width, height, fps, codec, keyframes FROM videos "
+            "WHERE duration >= ? ORDER BY path",
+            (min_duration,),
+        ).fetchall()
+        folder = os.path.normpath(folder)
+        return [VideoInfo(*r[:6], json.loads(r[6])) for r in rows if os.path.normpath(os.path.dirname(r[0])) == folder]
+
+    def get(self, path: str) -> VideoInfo:
+        """Indexed metadata for one file, probing it first if it isn't indexed yet."""
+        path = os.path.normpath(path)
+        row = self.con.execute(
+            "SELECT path, duration, width, height, fps, codec, keyframes FROM videos WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None:
+            info = self._store(path, os.stat(path))
+            self.con.commit()
+            return info
+        return VideoInfo(*row[:6], json.loads(row[6]))
+
+    def pick_segment(self, duration: float, folder=VIDEO_FOLDER) -> Tuple[str, float]:
+        """(video path, keyframe start) of a random `duration`-second window.
+
+        Only videos at least `duration` long are considered; if none is, the
+        longest video is used from its start (the old behaviour for short clips).
+        """
+        self.refresh(folder)
+        return self.pick_from(self.videos(folder), duration, folder)
+
+    def pick_from(self, videos: List[VideoInfo], duration: float, folder=VIDEO_FOLDER) -> Tuple[str, float]:
+        """pick_segment over an explicit list of indexed videos (`folder` is only used in messages)."""
+        candidates = [v for v in videos if v.duration >= duration]
+        if not candidates:
+            if not videos:
+                raise ValueError(f"No background videos found in '{folder}'")
+            longest = max(videos, key=lambda v: v.duration)
+            print(f"⚠️ No background video is {duration:.1f}s long; using {longest.path}")
+            return longest.path, 0.0
+        video = random.choice(candidates)
+        max_start = video.duration - duration
+        starts = [k for k in video.keyframes if k <= max_start] or [0.0]
+        return video.path, random.choice(starts)
+
+
+if __name__ == "__main__":
+    folder = sys.argv[1] if len(sys.argv) > 1 else VIDEO_FOLDER
+    index = VideoIndex()
+    n = index.refresh(folder)
+    print(f"Probed {n} file(s)")
+    for v in index.videos(folder):
+        print(f"{v.path}: {v.duration:.1f}s {v.width}x{v.height} {v.fps:.2f}fps {v.codec}, "
+              f"{len(v.keyframes)} keyframes")
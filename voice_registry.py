@@ -0,0 +1,67 @@
+"""
+Tortoise voice registry: conditioning latents computed once per voice.
+
+Tortoise normally rebuilds a voice's conditioning latents from its sample clips
+on every run. The registry saves them under .voice_cache/, keyed by a hash of
+the voice's sample files, so later runs load them instantly and several voices
+can be kept ready. Editing or replacing a voice's clips changes the hash and
+triggers a recompute.
+"""
+
+import hashlib
+from pathlib import Path
+
+import torch
+from tortoise.utils.audio import get_voices, load_voice
+
+VOICE_CACHE_DIR = Path(".voice_cache")
+
+
+def voice_hash(voice: str) -> str:
+    """sha256 over the names and bytes of the voice's sample files."""
+    files = sorted(get_voices().get(voice, []))
+    if not files:
+        raise ValueError(f"Unknown Tortoise voice: {voice}")
+    h = hashlib.sha256()
+    for f in files:
+        h.update(Path(f).name.encode())
+        h.update(Path(f).read_bytes())
+    return h.hexdigest()
+
+
+class VoiceRegistry:
+    def __init__(self, tts=None, cache_dir=VOICE_CACHE_DIR):
+        self.tts = tts
+        self.cache_dir = Path(cache_dir)
+        self._loaded = {}
+        self._ids = {}
+
+    def voice_id(self, voice: str) -> str:
+        """'<voice>-<hash16>': changes whenever the voice's sample files change."""
+        if voice not in self._ids:
+            self._ids[voice] = f"{voice}-{voice_hash(voice)[:16]}"
+        return self._ids[voice]
+
+    def latents(self, voice: str):
+        """Conditioning latents for `voice`: memory, then disk, then computed and saved."""
+        if voice in self._loaded:
+            return self._loaded[voice]
+
+        path = self.cache_dir / f"{self.voice_id(voice)}.pth"
+        if path.exists():
+            latents = tuple(torch.load(path, map_location="cpu"))
+            print(f"🎙️ Loaded cached latents for '{voice}'")
+        else:
+            print(f"🎙️ Computing conditioning latents for '{voice}' (once)")
+            voice_samples, latents = load_voice(voice)
+            if latents is None:
+                if self.tts is None:
+                    from tortoise.api import TextToSpeech
+                    self.tts = TextToSpeech()
+                latents = self.tts.get_conditioning_latents(voice_samples)
+            latents = tuple(t.detach().cpu() for t in latents)
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            torch.save(latents, path)
+
+        self._loaded[voice] = latents
+        return latents
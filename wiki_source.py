@@ -0,0 +1,155 @@
+"""
+Wikipedia page sources for the RAG stage in text-gen-v13.py.
+
+- CachedWikiSource: wikipedia-api behind an on-disk SQLite cache keyed by title
+  (summary + top-level section texts), with a TTL and size-bounded LRU eviction.
+  Missing pages are cached too, so topic picking doesn't ask twice.
+- SnapshotWikiSource: fully offline; reads pages from a local JSONL snapshot
+  ({"title": ..., "summary": ..., "sections": [...]} per line). No network,
+  no wikipedia-api install needed.
+
+Build a snapshot for the render boxes from a warm cache:
+    python wiki_source.py export wiki_snapshot.jsonl
+"""
+
+import json
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from tracing import span
+
+CACHE_PATH = "wiki_cache.sqlite"
+CACHE_TTL_DAYS = 30
+CACHE_MAX_MB = 200
+USER_AGENT = "yt-short-rag/2.0 (contact: youremail@example.com)"
+
+
+class Page(NamedTuple):
+    title: str
+    summary: str
+    sections: List[str]  # text of each top-level section, in page order
+
+
+class CachedWikiSource:
+    def __init__(self, cache_path: str = CACHE_PATH, ttl_days: float = CACHE_TTL_DAYS,
+                 max_mb: float = CACHE_MAX_MB, language: str = "en", user_agent: str = USER_AGENT):
+        self.ttl = ttl_days * 86400
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.language = language
+        self.user_agent = user_agent
+        self._wiki = None
+        self._lock = threading.Lock()
+        self.con = sqlite3.connect(cache_path, check_same_thread=False)
+        self.con.execute("""
+        CREATE TABLE IF NOT EXISTS pages(
+            title TEXT PRIMARY KEY,
+            fetched_at REAL,
+            last_used REAL,
+            found INTEGER,
+            summary TEXT,
+            sections TEXT,
+            size INTEGER
+        )""")
+        self.con.commit()
+
+    def _client(self):
+        if self._wiki is None:
+            import wikipediaapi
+            self._wiki = wikipediaapi.Wikipedia(language=self.language, user_agent=self.user_agent)
+        return self._wiki
+
+    def _fetch(self, title: str) -> Optional[Page]:
+        with span("wiki.fetch", title=title):
+            page = self._client().page(title)
+            if not page.exists():
+                return None
+            return Page(title, page.summary or "", [s.text for s in page.sections])
+
+    def _store(self, title: str, page: Optional[Page]):
+        now = time.time()
+        summary = page.summary if page else ""
+        sections = json.dumps(page.sections if page else [])
+        size = len(title) + len(summary) + len(sections)
+        with self._lock:
+            self.con.execute(
+                "INSERT OR REPLACE INTO pages VALUES(?,?,?,?,?,?,?)",
+                (title, now, now, int(page is not None), summary, sections, size),
+            )
+            self._evict()
+            self.con.commit()
+
+    def _evict(self):
+        total = self.con.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for title, size in self.con.execute("SELECT title, size FROM pages ORDER BY last_used").fetchall():
+            self.con.execute("DELETE FROM pages WHERE title = ?", (title,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def get(self, title: str) -> Optional[Page]:
+        with self._lock:
+            row = self.con.execute(
+                "SELECT fetched_at, found, summary, sections FROM pages WHERE title = ?", (title,)
+            ).fetchone()
+            if row and time.time() - row[0] < self.ttl:
+                self.con.execute("UPDATE pages SET last_used = ? WHERE title = ?", (time.time(), title))
+                self.con.commit()
+                return Page(title, row[2], json.loads(row[3])) if row[1] else None
+        page = self._fetch(title)
+        self._store(title, page)
+        return page
+
+    def exists(self, title: str) -> bool:
+        return self.get(title) is not None
+
+    def cached_pages(self) -> List[Page]:
+        with self._lock:
+            rows = self.con.execute(
+                "SELECT title, summary, sections FROM pages WHERE found = 1 ORDER BY title"
+            ).fetchall()
+        return [Page(t, s, json.loads(sec)) for t, s, sec in rows]
+
+
+class SnapshotWikiSource:
+    def __init__(self, path: str):
+        self.pages: Dict[str, Page] = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                rec = json.loads(line)
+                self.pages[rec["title"]] = Page(rec["title"], rec.get("summary", ""), rec.get("sections", []))
+
+    def get(self, title: str) -> Optional[Page]:
+        return self.pages.get(title)
+
+    def exists(self, title: str) -> bool:
+        return title in self.pages
+
+
+def make_page_source(snapshot: Optional[str] = None):
+    """Offline snapshot source when `snapshot` is given, else the cached online source."""
+    if snapshot:
+        return SnapshotWikiSource(snapshot)
+    return CachedWikiSource()
+
+
+def export_snapshot(source: CachedWikiSource, path: str) -> int:
+    pages = source.cached_pages()
+    with open(path, "w", encoding="utf-8") as f:
+        for p in pages:
+            f.write(json.dumps(p._asdict(), ensure_ascii=False) + "\n")
+    return len(pages)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "export":
+        n = export_snapshot(CachedWikiSource(), sys.argv[2])
+        print(f"Wrote {n} pages to {sys.argv[2]}")
+    else:
+        print("usage: python wiki_source.py export <snapshot.jsonl>")
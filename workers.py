@@ -0,0 +1,149 @@
+"""
+Warm model workers.
+
+Loading Llama, Tortoise or Stable Diffusion takes longer than one story's worth
+of compute, so each heavy stage can run as a long-lived worker instead of a
+fresh interpreter per story. The worker loads its model once and then serves
+JSON jobs over a local Unix socket, one job at a time.
+
+Stage scripts start a worker with `--serve`:
+    python tortoise_gen.py --serve
+    python run_imager.py --serve
+    python text-gen-v13.py --serve
+
+pipe.py talks to them through WorkerClient and starts them on first use.
+Only the standard library is used here so every virtual env can import it.
+"""
+
+import json
+import subprocess
+import time
+import traceback
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from tracing import set_trace_file, span, trace_file
+
+WORKER_DIR = Path(".workers")
+AUTHKEY = b"yt-short-generator"
+START_TIMEOUT = 1800  # seconds; first model load may include a download
+
+
+def socket_path(name: str) -> Path:
+    return WORKER_DIR / f"{name}.sock"
+
+
+# =========================
+# Worker side
+# =========================
+def serve(name: str, handler: Callable[[dict], dict]) -> None:
+    """Serve jobs for `name` until a shutdown job arrives.
+
+    `handler` gets the job dict and returns a JSON-serialisable dict. A failing
+    job is reported back to the caller; the worker (and its model) stays up.
+    """
+    WORKER_DIR.mkdir(exist_ok=True)
+    path = socket_path(name)
+    if path.exists():
+        path.unlink()
+
+    with Listener(str(path), family="AF_UNIX", authkey=AUTHKEY) as listener:
+        print(f"🟢 {name} worker ready on {path}", flush=True)
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"⚠️ {name} worker rejected a connection: {e}", flush=True)
+                continue
+            with conn:
+                try:
+                    job = json.loads(conn.recv_bytes())
+                except (EOFError, ValueError):
+                    continue
+
+                op = job.get("op", "run")
+                if op == "ping":
+                    reply = {"ok": True, "result": {}}
+                elif op == "shutdown":
+                    conn.send_bytes(json.dumps({"ok": True, "result": {}}).encode())
+                    break
+                else:
+                    set_trace_file(job.pop("trace", None))  # the caller's run trace
+                    try:
+                        with span(f"worker.{name}"):
+                            reply = {"ok": True, "result": handler(job) or {}}
+                    except Exception as e:
+                        traceback.print_exc()
+                        reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                try:
+                    conn.send_bytes(json.dumps(reply).encode())
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+    if path.exists():
+        path.unlink()
+    print(f"🔴 {name} worker stopped", flush=True)
+
+
+# =========================
+# Client side
+# =========================
+class WorkerClient:
+    """Send jobs to a named worker, starting it with `cmd` when it is not running."""
+
+    def __init__(self, name: str, cmd: List[str]):
+        self.name = name
+        self.cmd = cmd
+        self.proc: Optional[subprocess.Popen] = None
+
+    def _connect(self):
+        return Client(str(socket_path(self.name)), family="AF_UNIX", authkey=AUTHKEY)
+
+    def _request(self, job: dict) -> dict:
+        with self._connect() as conn:
+            conn.send_bytes(json.dumps(job).encode())
+            return json.loads(conn.recv_bytes())
+
+    def is_running(self) -> bool:
+        if self.proc is not None and self.proc.poll() is None and socket_path(self.name).exists():
+            return True
+        try:
+            return self._request({"op": "ping"}).get("ok", False)
+        except (OSError, EOFError):
+            return False
+
+    def ensure_started(self) -> None:
+        if self.is_running():
+            return
+        print(f"🟡 Starting {self.name} worker (model load happens once)")
+        self.proc = subprocess.Popen(self.cmd)
+        deadline = time.time() + START_TIMEOUT
+        while time.time() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"{self.name} worker exited with code {self.proc.returncode}")
+            if socket_path(self.name).exists() and self.is_running():
+                return
+            time.sleep(1.0)
+        raise TimeoutError(f"{self.name} worker did not come up within {START_TIMEOUT}s")
+
+    def call(self, **job) -> dict:
+        """Run one job on the worker and return its result dict."""
+        self.ensure_started()
+        reply = self._request({"op": "run", "trace": trace_file(), **job})
+        if not reply.get("ok"):
+            raise RuntimeError(f"{self.name} worker job failed: {reply.get('error')}")
+        return reply["result"]
+
+    def shutdown(self) -> None:
+        """Stop the worker if it is running (whether or not we started it)."""
+        try:
+            self._request({"op": "shutdown"})
+        except (OSError, EOFError):
+            pass
+        if self.proc is not None:
+            try:
+                self.proc.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+            self.proc = None